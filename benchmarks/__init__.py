@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the database layer (run with python -m benchmarks.<name>)"""
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Per-query latency: connect-per-call versus the pooled connection manager.
+
+    python -m benchmarks.bench_connection [--queries 5000] [--members 2000]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from db.migrations import migrate
+from db.groups_db import get_group_by_id
+
+GROUP_QUERY = """
+    SELECT g.id, g.name, g.leader_member_id,
+           COALESCE(m.full_name, '-') as leader_name,
+           g.created_at
+    FROM groups g
+    LEFT JOIN members m ON g.leader_member_id = m.id
+    WHERE g.id = ?
+"""
+
+
+def populate(path, groups, members):
+    db.use_database(path)
+    migrate()
+    # db.connect() registers the PERSIAN collation and SQL functions that
+    # the schema's indexes and triggers use
+    conn = db.connect()
+    conn.executemany(
+        "INSERT INTO groups (id, name, created_at) VALUES (?, ?, '1404/01/01 10:00:00')",
+        [(i, f"group-{i}") for i in range(1, groups + 1)])
+    conn.executemany(
+        "INSERT INTO members (group_id, full_name, joined_at) VALUES (?, ?, '1404/01/01')",
+        [(i % groups + 1, f"member-{i}") for i in range(members)])
+    conn.commit()
+    conn.close()
+    db.close_all()
+
+
+def connect_per_call(path, group_id):
+    """The old db.fetch_all: open, set PRAGMA, query, close"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    cur = conn.cursor()
+    cur.execute(GROUP_QUERY, (group_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def timed(label, func, n):
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    elapsed = time.perf_counter() - start
+    per_query = elapsed / n * 1e6
+    print(f"{label:<22} {n:>7} queries  {elapsed:8.3f} s  {per_query:8.1f} µs/query")
+    return per_query
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--members", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        populate(path, args.groups, args.members)
+        db.use_database(path)
+
+        before = timed("connect per call", lambda i: connect_per_call(path, i % args.groups + 1), args.queries)
+        after = timed("pooled connection", lambda i: get_group_by_id(i % args.groups + 1), args.queries)
+        print(f"speed-up: {before / after:.1f}x")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
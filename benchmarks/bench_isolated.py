@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of starting isolated, fully migrated databases for tests and benchmarks.
+
+    python -m benchmarks.bench_isolated [--count 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from db.groups_db import add_group, get_all_groups
+from db.migrations import migrate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    for label, target in (("memory", db.MEMORY), ("temp file", db.TEMP)):
+        start = time.perf_counter()
+        for i in range(args.count):
+            with db.isolated_database(target):
+                migrate()
+                add_group(f"group-{i}")
+                assert len(get_all_groups()) == 1
+        elapsed = time.perf_counter() - start
+        print(f"{label:<10} {args.count:>5} databases  {elapsed:7.3f} s  "
+              f"{elapsed / args.count * 1000:7.2f} ms/database")
+
+
+if __name__ == "__main__":
+    main()
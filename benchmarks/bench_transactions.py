@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Commit and fsync counts for the common write flows, autocommit versus unit of work.
+
+    python -m benchmarks.bench_transactions [--members 50]
+
+Commits are counted by the db layer. SQLite does not expose an fsync
+counter, so fsyncs are estimated from the storage profile: in WAL mode a
+commit syncs the -wal file once with synchronous=FULL and not at all with
+synchronous=NORMAL (the sync happens at checkpoint time instead).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from db.migrations import migrate
+from db.groups_db import add_group, set_group_leader, create_group_with_members
+from db.members_db import add_member, update_member, toggle_member_active
+
+FSYNCS_PER_COMMIT = {"FULL": 1, "NORMAL": 0}
+
+
+def setup(members):
+    migrate()
+    _, group_id = add_group("source")
+    return [add_member(f"member-{i}", group_id)[1] for i in range(members)]
+
+
+def flow_create_group_autocommit(member_ids):
+    _, group_id = add_group("new group")
+    for member_id in member_ids:
+        update_member(member_id, f"member-{member_id - 1}", group_id)
+    set_group_leader(group_id, member_ids[0])
+
+
+def flow_create_group_uow(member_ids):
+    create_group_with_members("new group", member_ids, member_ids[0])
+
+
+def flow_toggle_autocommit(member_ids):
+    for member_id in member_ids:
+        toggle_member_active(member_id, 0)
+
+
+def flow_toggle_uow(member_ids):
+    with db.UnitOfWork() as uow:
+        for member_id in member_ids:
+            uow.call(toggle_member_active, member_id, 0)
+
+
+FLOWS = [
+    ("create group + move members + leader", flow_create_group_autocommit, flow_create_group_uow),
+    ("deactivate members", flow_toggle_autocommit, flow_toggle_uow),
+]
+
+
+def measure(synchronous, flow, members):
+    db.STORAGE_PROFILE["synchronous"] = synchronous
+    with db.isolated_database(db.TEMP):
+        member_ids = setup(members)
+        before = db.get_write_stats()["commits"]
+        start = time.perf_counter()
+        flow(member_ids)
+        elapsed = time.perf_counter() - start
+        commits = db.get_write_stats()["commits"] - before
+    return commits, commits * FSYNCS_PER_COMMIT[synchronous], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--members", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'flow':<38} {'sync':<7} {'mode':<11} {'commits':>7} {'fsyncs':>7} {'ms':>9}")
+    for synchronous in ("NORMAL", "FULL"):
+        for label, autocommit, uow in FLOWS:
+            for mode, flow in (("autocommit", autocommit), ("unit/work", uow)):
+                commits, fsyncs, elapsed = measure(synchronous, flow, args.members)
+                print(f"{label:<38} {synchronous:<7} {mode:<11} {commits:>7} {fsyncs:>7} {elapsed * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
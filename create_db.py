@@ -1,40 +1,25 @@
-import sqlite3
+import argparse
 
-DB_FILE = "fund.db"
+from db import use_database, get_database, close_all, add_database_argument
+from db.migrations import migrate, renamed_rows
 
-SCHEMA = """
-PRAGMA foreign_keys = ON;
 
--- 1) گروپ
-CREATE TABLE IF NOT EXISTS groups (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name TEXT NOT NULL UNIQUE,
-  leader_member_id INTEGER,
-  created_at TEXT NOT NULL
-);
-
--- 2) عضو
-CREATE TABLE IF NOT EXISTS members (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  group_id INTEGER NOT NULL,
-  full_name TEXT NOT NULL,
-  phone TEXT,
-  is_active INTEGER NOT NULL DEFAULT 1,
-  joined_at TEXT NOT NULL,
-  UNIQUE(full_name),
-  FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
-);
-
--- ایندکس‌ها برای سرعت
-CREATE INDEX IF NOT EXISTS idx_members_group_id ON members(group_id);
-"""
-
-def main():
-    conn = sqlite3.connect(DB_FILE)
-    conn.executescript(SCHEMA)
-    conn.commit()
-    conn.close()
-    print(f"✅ Database created/updated: {DB_FILE}")
+def main(argv=None):
+    parser = add_database_argument(argparse.ArgumentParser(description="Create or upgrade the fund database"))
+    args = parser.parse_args(argv)
+    if args.db:
+        use_database(args.db)
+    reports = migrate()
+    for report in reports:
+        print(f"  v{report.version} {report.step}: {report.seconds * 1000:.1f} ms")
+    renames = renamed_rows(reports)
+    if renames:
+        print(f"⚠️ {len(renames)} duplicate names were renamed (merge them by hand if needed):")
+        for rename in renames:
+            print(f"  {rename.table} {rename.row_id}: {rename.old_name} -> {rename.new_name}")
+    db_file = get_database()
+    close_all()
+    print(f"✅ Database created/updated: {db_file}")
 
 if __name__ == "__main__":
     main()
@@ -1,25 +1,698 @@
+import atexit
+import contextlib
+import os
+import pathlib
 import sqlite3
+import itertools
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from utils.date_utils import jalali_month, jalali_month_key, jalali_year, to_persian_digits
+from utils.text_utils import normalize_search, persian_collate
+
+# Special database targets for use_database() / SANDOQ_DB / --db
+MEMORY = ":memory:"   # private shared-cache in-memory database
+TEMP = ":temp:"       # fresh file in the temp directory, deleted by close_all()
+
+DEFAULT_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fund.db")
+DB_FILE = os.environ.get("SANDOQ_DB") or DEFAULT_DB_FILE
+
+# Storage profile applied to every connection. journal_mode and auto_vacuum
+# are persistent in the database file; the other settings are per
+# connection. auto_vacuum only takes effect on a new, empty database (an
+# existing one is converted by db.maintenance with a one-off VACUUM).
+STORAGE_PROFILE = {
+    "auto_vacuum": "INCREMENTAL",  # free pages are returned by db.maintenance
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",      # WAL + NORMAL: no fsync per commit, still crash safe
+    "cache_size": -16000,         # negative = KiB, i.e. ~16 MB page cache
+    "mmap_size": 64 * 1024 * 1024,
+    "busy_timeout": 5000,         # ms to wait on a lock before SQLITE_BUSY
+}
+
+# Background checkpointing: a PASSIVE checkpoint every CHECKPOINT_INTERVAL
+# seconds, and a TRUNCATE checkpoint once the -wal file grows beyond
+# CHECKPOINT_TRUNCATE_BYTES.
+CHECKPOINT_INTERVAL = 30.0
+CHECKPOINT_TRUNCATE_BYTES = 4 * 1024 * 1024
+
+
+def apply_storage_profile(conn, profile=None, read_only=False):
+    """Apply the storage PRAGMAs to a connection"""
+    profile = STORAGE_PROFILE if profile is None else profile
+    # auto_vacuum has to be set before journal_mode, which writes the header
+    if not read_only and profile.get("auto_vacuum"):
+        conn.execute(f"PRAGMA auto_vacuum = {profile['auto_vacuum']};")
+    if not read_only and profile.get("journal_mode"):
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']};")
+    for pragma in ("synchronous", "cache_size", "mmap_size", "busy_timeout"):
+        if pragma in profile:
+            conn.execute(f"PRAGMA {pragma} = {profile[pragma]};")
+
+
+def register_extensions(conn):
+    """Register the collations (and SQL functions) the schema and queries use.
+
+    Every connection that reads or writes through the name indexes needs
+    them, including ones opened outside the pool (backups, snapshots).
+    """
+    # "ORDER BY full_name COLLATE PERSIAN": Persian alphabetical order
+    conn.create_collation("PERSIAN", persian_collate)
+    # members_fts triggers and search_members(): Persian search folding
+    conn.create_function("fa_normalize", 1, normalize_search, deterministic=True)
+    # Jalali calendar, e.g. GROUP BY jalali_month_key(joined_day); deterministic,
+    # so they may also appear in indexes (idx_members_joined_month)
+    conn.create_function("jalali_year", 1, jalali_year, deterministic=True)
+    conn.create_function("jalali_month", 1, jalali_month, deterministic=True)
+    conn.create_function("jalali_month_key", 1, jalali_month_key, deterministic=True)
+    conn.create_function("persian_digits", 1, _persian_digits, deterministic=True)
+
+
+def _persian_digits(value):
+    return None if value is None else to_persian_digits(value)
+
+
+class ConnectionManager:
+    """Long-lived connections: one writer shared by all threads, one reader per thread.
+
+    Reusing connections keeps SQLite's statement cache and page cache warm
+    and runs the connection PRAGMAs only once. In WAL mode readers never
+    block the writer (or each other), so reads go through a read-only
+    connection owned by the calling thread while all writes are serialised
+    through the single writer connection. All connections are closed by
+    close_all(), which is registered to run at interpreter exit.
+
+    transaction() holds the writer for a whole block of statements; while a
+    thread is inside one, its execute() calls join the open transaction and
+    its fetch_all() calls read through the writer so they see their own
+    uncommitted changes.
+    """
+
+    def __init__(self, db_file, memory_uri=None):
+        self.db_file = db_file
+        # Set for in-memory databases: every connection opens this
+        # shared-cache URI, and the database lives as long as one of them.
+        self.memory_uri = memory_uri
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._connections = []
+        # Only touched while holding _write_lock.
+        self._tx_depth = 0
+        self._tx_owner = None
+        self.commits = 0
+        # Rows changed by writers that have since been closed
+        self.closed_changes = 0
+        # Bumped whenever the connections are closed (e.g. on use_database)
+        self.generation = 0
+
+    def open_connection(self, read_only=False):
+        """Open a new, unpooled connection configured like the pooled ones"""
+        # check_same_thread=False so close_all() can close every connection
+        # from the shutdown thread and the writer can be shared under
+        # _write_lock; readers are still used only by the thread that
+        # opened them.
+        if self.memory_uri:
+            conn = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False,
+                                   cached_statements=256)
+            if read_only:
+                # Shared cache uses table locks; reading uncommitted pages
+                # keeps readers from failing with SQLITE_LOCKED mid-write.
+                conn.execute("PRAGMA query_only = ON;")
+                conn.execute("PRAGMA read_uncommitted = ON;")
+        elif read_only:
+            uri = pathlib.Path(self.db_file).absolute().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=256)
+        else:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False,
+                                   cached_statements=256)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        register_extensions(conn)
+        apply_storage_profile(conn, read_only=read_only)
+        return conn
+
+    def _connect(self, read_only=False):
+        conn = self.open_connection(read_only)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _get_writer(self):
+        if self._writer is None:
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = self._connect()
+        return self._writer
+
+    def get(self):
+        """Return this thread's read-only connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # The writer creates the file and switches it to WAL, so it must
+            # exist before the first read-only connection is opened.
+            self._get_writer()
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+        return conn
+
+    def writer(self):
+        """Context manager holding the write lock and yielding the writer connection"""
+        return _WriterContext(self)
+
+    def in_transaction(self):
+        """True when the calling thread is inside transaction()"""
+        return self._tx_owner == threading.get_ident()
+
+    def changes(self):
+        """Rows inserted, updated or deleted through the writer so far"""
+        writer = self._writer
+        return self.closed_changes + (writer.total_changes if writer is not None else 0)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT around a block; nested calls use savepoints"""
+        with self.writer() as conn:
+            depth = self._tx_depth
+            savepoint = f"sp_{depth}"
+            if depth == 0:
+                conn.execute("BEGIN IMMEDIATE;")
+                self._tx_owner = threading.get_ident()
+            else:
+                conn.execute(f"SAVEPOINT {savepoint};")
+            self._tx_depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self._tx_owner = None
+                    conn.rollback()
+                else:
+                    conn.execute(f"ROLLBACK TO {savepoint};")
+                    conn.execute(f"RELEASE {savepoint};")
+                raise
+            self._tx_depth -= 1
+            if depth == 0:
+                self._tx_owner = None
+                try:
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self.commits += 1
+            else:
+                conn.execute(f"RELEASE {savepoint};")
+
+    def close_all(self):
+        """Close every connection opened by this manager"""
+        with self._write_lock:
+            with self._lock:
+                connections, self._connections = self._connections, []
+            # Close the writer last: only a read-write connection can
+            # checkpoint and remove the -wal/-shm files on close.
+            connections.sort(key=lambda c: c is self._writer)
+            if self._writer is not None:
+                self.closed_changes += self._writer.total_changes
+            for conn in connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._writer = None
+            self._tx_depth = 0
+            self._tx_owner = None
+            self._local = threading.local()
+            self.generation += 1
+
+
+class _WriterContext:
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __enter__(self):
+        self.manager._write_lock.acquire()
+        try:
+            return self.manager._get_writer()
+        except Exception:
+            self.manager._write_lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        self.manager._write_lock.release()
+        return False
+
+
+class Checkpointer(threading.Thread):
+    """Background thread that keeps the -wal file small.
+
+    Runs on its own connection so a PASSIVE checkpoint never waits for the
+    writer lock; only the occasional TRUNCATE checkpoint waits (via
+    busy_timeout) for in-flight readers and writers to finish.
+    """
+
+    def __init__(self, db_file, interval=CHECKPOINT_INTERVAL,
+                 truncate_bytes=CHECKPOINT_TRUNCATE_BYTES):
+        super().__init__(name="sqlite-checkpointer", daemon=True)
+        self.db_file = db_file
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {STORAGE_PROFILE['busy_timeout']};")
+        try:
+            while not self._stop_event.wait(self.interval):
+                self.checkpoint(conn)
+            self.checkpoint(conn, mode="TRUNCATE")
+        finally:
+            conn.close()
+
+    def checkpoint(self, conn, mode=None):
+        if mode is None:
+            try:
+                wal_size = os.path.getsize(self.db_file + "-wal")
+            except OSError:
+                return
+            mode = "TRUNCATE" if wal_size > self.truncate_bytes else "PASSIVE"
+        try:
+            conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchall()
+        except sqlite3.OperationalError:
+            pass  # busy; try again on the next tick
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+_manager = ConnectionManager(DB_FILE)
+_checkpointer = None
 
-DB_FILE = "fund.db"
 
 def get_conn():
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    """Return the calling thread's shared read-only connection (do not close it)"""
+    return _manager.get()
 
-def fetch_all(query, params=()):
+
+def connect(read_only=False):
+    """Open a standalone connection to the current database; the caller closes it.
+
+    For long-running jobs (backups, snapshots, maintenance) that should not
+    tie up the pooled connections.
+    """
+    _manager._get_writer()  # make sure the file exists and is in WAL mode
+    return _manager.open_connection(read_only)
+
+
+def start_checkpointer(interval=CHECKPOINT_INTERVAL):
+    """Move WAL checkpoints off the commit path into a background thread"""
+    global _checkpointer
+    if _checkpointer is not None or _manager.memory_uri:
+        return
+    with _manager.writer() as conn:
+        # Commits no longer trigger an inline checkpoint.
+        conn.execute("PRAGMA wal_autocheckpoint = 0;")
+    _checkpointer = Checkpointer(_manager.db_file, interval)
+    _checkpointer.start()
+
+
+def stop_checkpointer():
+    """Stop the background checkpointer after a final TRUNCATE checkpoint"""
+    global _checkpointer
+    if _checkpointer is None:
+        return
+    _checkpointer.stop()
+    _checkpointer = None
+    with _manager.writer() as conn:
+        conn.execute("PRAGMA wal_autocheckpoint = 1000;")
+
+
+_temp_file = None
+_memory_names = itertools.count(1)
+
+
+def close_all():
+    """Stop background work and close all pooled connections.
+
+    An in-memory database is gone once its connections are closed, and a
+    TEMP database file is deleted.
+    """
+    global _temp_file
+    stop_checkpointer()
+    _manager.close_all()
+    if _temp_file:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(_temp_file + suffix)
+            except OSError:
+                pass
+        _temp_file = None
+
+
+atexit.register(close_all)
+
+
+def use_database(db_file):
+    """Point the db layer at another database and return the resolved target.
+
+    db_file is a file path, MEMORY for a new private in-memory database
+    (shared by all of this process's connections through the shared
+    cache) or TEMP for a new empty file in the temp directory. MEMORY and
+    TEMP databases are discarded by close_all()/the next use_database().
+    """
+    global DB_FILE, _temp_file
+    close_all()
+    memory_uri = None
+    if db_file == MEMORY:
+        memory_uri = f"file:sandoq-mem-{os.getpid()}-{next(_memory_names)}?mode=memory&cache=shared"
+        db_file = memory_uri
+    elif db_file == TEMP:
+        fd, db_file = tempfile.mkstemp(prefix="sandoq-", suffix=".db")
+        os.close(fd)
+        _temp_file = db_file
+    DB_FILE = db_file
+    _manager.db_file = db_file
+    _manager.memory_uri = memory_uri
+    return db_file
+
+
+if DB_FILE in (MEMORY, TEMP):
+    use_database(DB_FILE)
+
+
+def get_database():
+    """The current database target (a path or an in-memory URI)"""
+    return DB_FILE
+
+
+def is_memory_database():
+    return _manager.memory_uri is not None
+
+
+@contextlib.contextmanager
+def isolated_database(db_file=MEMORY):
+    """Run a block against its own database, then switch back.
+
+    The default is a fresh in-memory database; pass TEMP for a throw-away
+    file. If the previous target was itself MEMORY or TEMP, a new empty one
+    is created on the way back.
+    """
+    previous = DB_FILE
+    if _manager.memory_uri:
+        previous = MEMORY
+    elif previous == _temp_file:
+        previous = TEMP
+    target = use_database(db_file)
+    try:
+        yield target
+    finally:
+        use_database(previous)
+
+
+def add_database_argument(parser):
+    """Add --db to an argparse parser (a path, :memory: or :temp:)"""
+    parser.add_argument("--db", metavar="PATH", default=None,
+                        help=f"database file, {MEMORY} or {TEMP} "
+                             f"(default: $SANDOQ_DB or {DEFAULT_DB_FILE})")
+    return parser
+
+
+def transaction():
+    """Context manager running a block of statements as one transaction.
+
+    execute() calls inside the block do not commit; the block commits once
+    on exit or rolls back entirely if it raises. Nested transaction() blocks
+    become savepoints, so an inner failure can be caught without losing
+    the outer work.
+    """
+    return _manager.transaction()
+
+
+class UnitOfWorkError(Exception):
+    """A step inside a UnitOfWork reported failure"""
+
+
+class UnitOfWork:
+    """Run several groups_db/members_db operations as one transaction.
+
+    The repository functions report errors as (False, message) rather than
+    raising; call() turns such a result into UnitOfWorkError so the whole
+    unit rolls back.
+
+        with UnitOfWork() as uow:
+            group_id = uow.call(add_group, name)
+            uow.call(move_members_to_group, member_ids, group_id)
+    """
+
+    def __init__(self):
+        self._tx = None
+
+    def __enter__(self):
+        self._tx = transaction()
+        self._tx.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        tx, self._tx = self._tx, None
+        return tx.__exit__(exc_type, exc, tb)
+
+    def call(self, func, *args, **kwargs):
+        """Call a (success, value) function and return value, raising on failure"""
+        result = func(*args, **kwargs)
+        if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], bool):
+            success, value = result
+            if not success:
+                raise UnitOfWorkError(value)
+            return value
+        return result
+
+
+def in_transaction():
+    """True when the calling thread is inside transaction()"""
+    return _manager.in_transaction()
+
+
+def writer():
+    """Hold the write lock and yield the shared writer connection.
+
+    For statements that must run outside a transaction on the writer, such
+    as ATTACH/DETACH; use transaction() for normal writes.
+    """
+    return _manager.writer()
+
+
+def get_change_token():
+    """A cheap value that changes whenever the database may have changed.
+
+    Combines PRAGMA data_version of the calling thread's reader (bumped by
+    commits from any other connection, including other processes) with
+    this process's commit counter (which also covers shared-cache memory
+    databases, where data_version does not move) and the connection
+    generation (bumped by use_database/close_all). Tokens are only
+    comparable within one thread.
+    """
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    data_version = conn.execute("PRAGMA data_version;").fetchone()[0]
+    return (_manager.generation, threading.get_ident(), data_version, _manager.commits)
 
-def execute(query, params=()):
+
+def get_write_stats():
+    """Counters for the writer connection since the db layer started"""
+    return {"commits": _manager.commits, "changes": _manager.changes()}
+
+
+# Called as observer(query, params, seconds, rowcount) after every
+# fetch_all/execute when set (see db.instrumentation). None keeps the query
+# path free of any timing work.
+_query_observer = None
+
+
+def set_query_observer(observer):
+    """Install (or remove, with None) the per-query observer"""
+    global _query_observer
+    _query_observer = observer
+
+
+def _fetch_all(query, params):
+    if _manager.in_transaction():
+        with _manager.writer() as conn:
+            return conn.execute(query, params).fetchall()
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(query, params)
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
-    return last_id
+    return conn.execute(query, params).fetchall()
+
+
+def _execute(query, params, returning=False):
+    """Run a write; returns (cursor, rows), rows being the RETURNING rows if asked for"""
+    with _manager.writer() as conn:
+        if _manager.in_transaction():
+            # Part of an open transaction: a failed statement is already
+            # undone by SQLite, the caller decides about the rest.
+            cur = conn.execute(query, params)
+            return cur, cur.fetchall() if returning else None
+        try:
+            cur = conn.execute(query, params)
+            # RETURNING rows have to be read before the commit
+            rows = cur.fetchall() if returning else None
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _manager.commits += 1
+        return cur, rows
+
+
+def fetch_all(query, params=()):
+    observer = _query_observer
+    if observer is None:
+        return _fetch_all(query, params)
+    start = time.perf_counter()
+    rows = None
+    try:
+        rows = _fetch_all(query, params)
+        return rows
+    finally:
+        # rowcount -1 marks a failed query
+        observer(query, params, time.perf_counter() - start,
+                 -1 if rows is None else len(rows))
+
+
+def execute(query, params=()):
+    observer = _query_observer
+    if observer is None:
+        return _execute(query, params)[0].lastrowid
+    start = time.perf_counter()
+    cur = None
+    try:
+        cur = _execute(query, params)[0]
+        return cur.lastrowid
+    finally:
+        observer(query, params, time.perf_counter() - start,
+                 -1 if cur is None else cur.rowcount)
+
+
+def execute_returning(query, params=()):
+    """Run an INSERT/UPDATE/DELETE ... RETURNING and return its rows"""
+    observer = _query_observer
+    if observer is None:
+        return _execute(query, params, returning=True)[1]
+    start = time.perf_counter()
+    rows = None
+    try:
+        rows = _execute(query, params, returning=True)[1]
+        return rows
+    finally:
+        observer(query, params, time.perf_counter() - start,
+                 -1 if rows is None else len(rows))
+
+
+def is_unique_violation(error, column=None):
+    """True if `error` is a UNIQUE constraint failure (on `column`, e.g. "groups.name")"""
+    if not isinstance(error, sqlite3.IntegrityError):
+        return False
+    message = str(error)
+    if not message.startswith("UNIQUE constraint failed"):
+        return False
+    return column is None or column in message.split(":", 1)[1].replace(" ", "").split(",")
+
+
+def is_foreign_key_violation(error):
+    """True if `error` is a FOREIGN KEY constraint failure"""
+    return isinstance(error, sqlite3.IntegrityError) and "FOREIGN KEY constraint failed" in str(error)
+
+
+# One page of a keyset-paginated query. next_cursor is the id to pass as
+# cursor for the following page (None on the last page); total depends on
+# the count strategy and is None when not computed.
+Page = namedtuple("Page", ["rows", "next_cursor", "total"])
+
+# Total-count strategies for fetch_page():
+#   None       no count (cheapest; fine for "load more" lists)
+#   "exact"    COUNT(*) with the same filters on every page
+#   "first"    exact count on the first page only (cursor is None)
+#   "estimate" highest id ever assigned (sqlite_sequence), ignores filters
+COUNT_STRATEGIES = (None, "exact", "first", "estimate")
+
+
+def _count(table, conditions, params, total, cursor):
+    """The page total for a count strategy (None when not computed)"""
+    if total == "exact" or (total == "first" and cursor is None):
+        count_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return fetch_all(f"SELECT COUNT(*) FROM {table} {count_where}", params)[0][0]
+    if total == "estimate":
+        result = fetch_all("SELECT seq FROM sqlite_sequence WHERE name = ?",
+                           (table.split()[0],))
+        return result[0][0] if result else 0
+    return None
+
+
+def fetch_page(select, table, conditions=(), params=(), page_size=50,
+               cursor=None, total=None, id_column="id"):
+    """Fetch one page of `select` ordered by id descending using a keyset cursor.
+
+    `select` is the SELECT ... FROM ... part without WHERE/ORDER BY, `table`
+    is the "name alias" of the paginated table (used for counting), and
+    `conditions` are SQL filters joined with AND. The first column of each
+    row must be the id. Each page is an index range scan on the primary key
+    (or on a filter index), so its cost does not grow with the page number
+    the way OFFSET does.
+    """
+    if total not in COUNT_STRATEGIES:
+        raise ValueError(f"unknown count strategy: {total!r}")
+    where = list(conditions)
+    page_params = list(params)
+    if cursor is not None:
+        where.append(f"{id_column} < ?")
+        page_params.append(cursor)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    rows = fetch_all(f"{select} {where_sql} ORDER BY {id_column} DESC LIMIT ?",
+                     (*page_params, page_size + 1))
+    next_cursor = rows[page_size - 1][0] if len(rows) > page_size else None
+    rows = rows[:page_size]
+    return Page(rows, next_cursor, _count(table, conditions, params, total, cursor))
+
+
+def fetch_sorted_page(select, table, sort_column, conditions=(), params=(), page_size=50,
+                      cursor=None, total=None, id_column="id", sort_position=1):
+    """Like fetch_page(), but ordered by `sort_column` ascending, then id.
+
+    `sort_column` may carry a collation (e.g. "m.full_name COLLATE
+    PERSIAN"); with an index on (sort column, id) in the same collation
+    each page is an index range scan with no sort step. The cursor is the
+    (sort value, id) pair of the last row; the sort value is taken from
+    position `sort_position` of each row.
+    """
+    if total not in COUNT_STRATEGIES:
+        raise ValueError(f"unknown count strategy: {total!r}")
+    where = list(conditions)
+    page_params = list(params)
+    if cursor is not None:
+        # Spelled out rather than as a row value so the planner seeks the
+        # index to the cursor instead of scanning up to it
+        sort_value, last_id = cursor
+        where.append(f"{sort_column} >= ? AND ({sort_column} > ? OR {id_column} > ?)")
+        page_params.extend((sort_value, sort_value, last_id))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    rows = fetch_all(f"{select} {where_sql} ORDER BY {sort_column}, {id_column} LIMIT ?",
+                     (*page_params, page_size + 1))
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = (last[sort_position], last[0])
+    rows = rows[:page_size]
+    return Page(rows, next_cursor, _count(table, conditions, params, total, cursor))
+
+
+def iter_pages(fetch, page_size=200, **filters):
+    """Yield successive pages from a get_*_page function until exhausted"""
+    cursor = None
+    while True:
+        page = fetch(page_size=page_size, cursor=cursor, **filters)
+        if page.rows:
+            yield page
+        if page.next_cursor is None:
+            return
+        cursor = page.next_cursor
@@ -17,4 +17,34 @@ spec.loader.exec_module(root_db)
 # Re-export functions
 fetch_all = root_db.fetch_all
 execute = root_db.execute
+execute_returning = root_db.execute_returning
+is_unique_violation = root_db.is_unique_violation
+is_foreign_key_violation = root_db.is_foreign_key_violation
 get_conn = root_db.get_conn
+connect = root_db.connect
+close_all = root_db.close_all
+use_database = root_db.use_database
+get_database = root_db.get_database
+is_memory_database = root_db.is_memory_database
+isolated_database = root_db.isolated_database
+add_database_argument = root_db.add_database_argument
+MEMORY = root_db.MEMORY
+TEMP = root_db.TEMP
+apply_storage_profile = root_db.apply_storage_profile
+register_extensions = root_db.register_extensions
+start_checkpointer = root_db.start_checkpointer
+stop_checkpointer = root_db.stop_checkpointer
+STORAGE_PROFILE = root_db.STORAGE_PROFILE
+transaction = root_db.transaction
+UnitOfWork = root_db.UnitOfWork
+UnitOfWorkError = root_db.UnitOfWorkError
+get_write_stats = root_db.get_write_stats
+in_transaction = root_db.in_transaction
+writer = root_db.writer
+get_change_token = root_db.get_change_token
+Page = root_db.Page
+fetch_page = root_db.fetch_page
+fetch_sorted_page = root_db.fetch_sorted_page
+iter_pages = root_db.iter_pages
+COUNT_STRATEGIES = root_db.COUNT_STRATEGIES
+set_query_observer = root_db.set_query_observer
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Archive database for inactive members
+
+Inactive members are moved out of fund.db into fund-archive.db (next to
+it), so members and every list screen that scans it only carry the
+people who are still active. The archive is ATTACHed as schema `archive`
+on demand: on the writer when members are archived or restored, and on a
+thread's reader connection, read-only, for historical queries. The TEMP
+view `all_members` (created with the attachment) is the UNION of both
+for the rare query that needs everyone.
+
+Archived rows keep their member id (ids are AUTOINCREMENT and never
+reused) and a copy of their group's name, since the group may be deleted
+later. Moves are done in two committed steps per batch, copy then delete
+of the copied ids: transactions spanning two WAL databases are not atomic
+across a crash, and in this order a crash can leave a row in both files
+(the next run finishes it) but never in neither.
+
+ATTACH cannot run inside a transaction, so call ensure_archive() (or any
+function here) before opening one that reads archive.members.
+"""
+
+import os
+import pathlib
+import sqlite3
+
+from db import fetch_all, get_conn, get_database, in_transaction, is_memory_database
+from db import transaction, writer
+from utils.date_utils import get_current_persian_datetime, persian_date_to_day
+
+ARCHIVE_SCHEMA = "archive"
+DEFAULT_BATCH_SIZE = 500
+
+_ARCHIVE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS archive.members (
+      id INTEGER PRIMARY KEY,
+      group_id INTEGER NOT NULL,
+      group_name TEXT,
+      full_name TEXT NOT NULL,
+      phone TEXT,
+      is_active INTEGER NOT NULL,
+      joined_at TEXT NOT NULL,
+      archived_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_archived_members_group_id ON members(group_id)",
+]
+
+_ALL_MEMBERS_VIEW = """
+    CREATE TEMP VIEW IF NOT EXISTS all_members AS
+    SELECT m.id, m.full_name, m.group_id, g.name AS group_name, m.phone,
+           m.is_active, m.joined_at, NULL AS archived_at
+    FROM main.members m
+    LEFT JOIN main.groups g ON g.id = m.group_id
+    WHERE m.deleted_at IS NULL
+    UNION ALL
+    SELECT id, full_name, group_id, group_name, phone, is_active, joined_at, archived_at
+    FROM archive.members
+"""
+
+
+class ArchiveError(Exception):
+    """The archive could not be attached"""
+
+
+def archive_path():
+    """The archive database next to the current database"""
+    target = get_database()
+    if is_memory_database():
+        # A second shared-cache memory database living as long as the writer
+        return target.replace("?", "-archive?", 1)
+    root, ext = os.path.splitext(target)
+    return f"{root}-archive{ext or '.db'}"
+
+
+def _is_attached(conn):
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute("PRAGMA database_list;"))
+
+
+def _create_view(conn):
+    # Memory-database readers are query_only, which also blocks TEMP objects
+    query_only = conn.execute("PRAGMA query_only;").fetchone()[0]
+    if query_only:
+        conn.execute("PRAGMA query_only = OFF;")
+    try:
+        conn.execute(_ALL_MEMBERS_VIEW)
+    finally:
+        if query_only:
+            conn.execute("PRAGMA query_only = ON;")
+
+
+def ensure_archive():
+    """Create the archive if needed and attach it to the writer and this thread's reader"""
+    with writer() as conn:
+        if not _is_attached(conn):
+            if in_transaction():
+                raise ArchiveError("cannot ATTACH the archive inside a transaction")
+            conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA};", (archive_path(),))
+            if not is_memory_database():
+                conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode = WAL;")
+            for statement in _ARCHIVE_TABLES:
+                conn.execute(statement)
+            conn.commit()
+            _create_view(conn)
+    if not in_transaction():
+        reader = get_conn()
+        if not _is_attached(reader):
+            path = archive_path()
+            if not is_memory_database():
+                # ATTACH does not inherit the reader's read-only mode
+                path = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+            reader.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA};", (path,))
+            _create_view(reader)
+
+
+def archive_members(joined_before=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Move inactive members to the archive in batches; returns how many moved.
+
+    joined_before (a Jalali 'YYYY/MM/DD' date) limits it to members who
+    joined before that date, e.g. the start of the first open year. Group
+    leaders stay in fund.db. `progress`, if given, is called with the
+    running total after each batch. An unreadable date archives nothing.
+    """
+    first_kept_day = None
+    if joined_before:
+        first_kept_day = persian_date_to_day(joined_before)
+        if first_kept_day is None:
+            return 0
+    ensure_archive()
+    conditions = ["m.is_active = 0", "m.deleted_at IS NULL",
+                  "m.id NOT IN (SELECT leader_member_id FROM main.groups "
+                  "WHERE leader_member_id IS NOT NULL AND deleted_at IS NULL)"]
+    params = []
+    if first_kept_day is not None:
+        # The day number, not the stored text, which mixes Jalali and
+        # Gregorian dates
+        conditions.append("m.joined_day < ?")
+        params.append(first_kept_day)
+    where = " AND ".join(conditions)
+
+    archived = 0
+    archived_at = get_current_persian_datetime()
+    while True:
+        with transaction() as conn:
+            ids = [row[0] for row in conn.execute(
+                f"SELECT m.id FROM main.members m WHERE {where} ORDER BY m.id LIMIT ?",
+                (*params, batch_size))]
+            if not ids:
+                break
+            placeholders = ", ".join("?" * len(ids))
+            conn.execute(f"""
+                INSERT OR IGNORE INTO archive.members
+                  (id, group_id, group_name, full_name, phone, is_active, joined_at, archived_at)
+                SELECT m.id, m.group_id, g.name, m.full_name, m.phone, m.is_active,
+                       m.joined_at, ?
+                FROM main.members m
+                LEFT JOIN main.groups g ON g.id = m.group_id
+                WHERE m.id IN ({placeholders})
+            """, (archived_at, *ids))
+        with transaction() as conn:
+            conn.execute(f"""
+                DELETE FROM main.members
+                WHERE id IN ({placeholders})
+                  AND id IN (SELECT id FROM archive.members)
+            """, ids)
+        archived += len(ids)
+        if progress:
+            progress(archived)
+    if archived and not is_memory_database():
+        # The background checkpointer only covers fund.db
+        with writer() as conn:
+            conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.wal_checkpoint(TRUNCATE);").fetchall()
+    return archived
+
+
+def restore_member(member_id):
+    """Move an archived member back into fund.db (inactive)"""
+    try:
+        ensure_archive()
+        with transaction() as conn:
+            row = conn.execute("""
+                SELECT a.id, a.group_id, a.full_name, a.phone, a.joined_at,
+                       g.id IS NOT NULL
+                FROM archive.members a
+                LEFT JOIN main.groups g ON g.id = a.group_id AND g.deleted_at IS NULL
+                WHERE a.id = ?
+            """, (member_id,)).fetchone()
+            if row is None:
+                return False, "عضو در بایگانی یافت نشد"
+            if not row[5]:
+                return False, "گروه این عضو دیگر وجود ندارد"
+            # Already there if an earlier restore stopped between its two steps
+            if not conn.execute("SELECT 1 FROM main.members WHERE id = ?;",
+                                (member_id,)).fetchone():
+                conn.execute("""
+                    INSERT INTO main.members
+                      (id, group_id, full_name, phone, is_active, joined_at, joined_day)
+                    VALUES (?, ?, ?, ?, 0, ?, ?)
+                """, (*row[:5], persian_date_to_day(row[4])))
+        with transaction() as conn:
+            conn.execute("""
+                DELETE FROM archive.members
+                WHERE id = ? AND id IN (SELECT id FROM main.members)
+            """, (member_id,))
+        return True, "عضو با موفقیت از بایگانی بازگردانده شد"
+    except sqlite3.IntegrityError:
+        return False, "عضوی با این نام قبلاً وجود دارد!"
+    except Exception as e:
+        return False, str(e)
+
+
+def get_archived_members(group_id=None):
+    """Archived members, most recently archived first"""
+    ensure_archive()
+    query = """
+        SELECT id, full_name, group_id, group_name, phone, is_active, joined_at, archived_at
+        FROM archive.members
+    """
+    params = ()
+    if group_id is not None:
+        query += " WHERE group_id = ?"
+        params = (group_id,)
+    query += " ORDER BY archived_at DESC, id DESC"
+    return fetch_all(query, params)
+
+
+def get_member_history(group_id=None):
+    """Current and archived members together, from the all_members view"""
+    ensure_archive()
+    query = """
+        SELECT id, full_name, group_id, group_name, phone, is_active, joined_at, archived_at
+        FROM all_members
+    """
+    params = ()
+    if group_id is not None:
+        query += " WHERE group_id = ?"
+        params = (group_id,)
+    query += " ORDER BY id DESC"
+    return fetch_all(query, params)
+
+
+def archive_stats():
+    """(members in fund.db, inactive members in fund.db, archived members)"""
+    ensure_archive()
+    return fetch_all("""
+        SELECT (SELECT COUNT(*) FROM main.members WHERE deleted_at IS NULL),
+               (SELECT COUNT(*) FROM main.members WHERE is_active = 0 AND deleted_at IS NULL),
+               (SELECT COUNT(*) FROM archive.members)
+    """)[0]
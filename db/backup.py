@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Online backups with the SQLite backup API
+
+Copying fund.db while the app has it open can capture a half-written
+file. Connection.backup() instead copies a consistent image page by page;
+here it copies `pages_per_step` pages at a time and sleeps in between, so
+the writer is only ever held up for one small step. Each copy is written
+to a temporary name, checked with PRAGMA integrity_check and only then
+renamed to fund-YYYYmmdd-HHMMSS.db. The newest `keep` copies are kept.
+
+Backups run on their own thread (backup_in_background) and, when
+start_backup_schedule() is called, periodically.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from db import connect, get_database, is_memory_database, register_extensions
+
+BACKUP_PREFIX = "fund-"
+BACKUP_SUFFIX = ".db"
+DEFAULT_KEEP = 10
+DEFAULT_PAGES_PER_STEP = 256
+DEFAULT_STEP_SLEEP = 0.01
+DEFAULT_INTERVAL = 6 * 60 * 60
+
+BackupResult = namedtuple("BackupResult", ["path", "pages", "seconds", "integrity"])
+
+
+class BackupError(Exception):
+    """The backup copy could not be made or failed verification"""
+
+
+def default_backup_dir():
+    if is_memory_database():
+        return os.path.join(os.getcwd(), "backups")
+    return os.path.join(os.path.dirname(os.path.abspath(get_database())), "backups")
+
+
+def list_backups(backup_dir=None):
+    """Backup files in backup_dir, oldest first"""
+    backup_dir = backup_dir or default_backup_dir()
+    if not os.path.isdir(backup_dir):
+        return []
+    paths = [os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+             if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def rotate_backups(backup_dir=None, keep=DEFAULT_KEEP):
+    """Delete all but the newest `keep` backups; returns the deleted paths"""
+    backups = list_backups(backup_dir)
+    removed = backups[:-keep] if keep > 0 else backups
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def create_backup(backup_dir=None, keep=DEFAULT_KEEP,
+                  pages_per_step=DEFAULT_PAGES_PER_STEP, sleep=DEFAULT_STEP_SLEEP,
+                  progress=None):
+    """Copy the live database to a new verified, timestamped backup.
+
+    `progress`, if given, is called as progress(remaining, total) after each
+    step. Raises BackupError if the copy fails integrity_check.
+    """
+    backup_dir = backup_dir or default_backup_dir()
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}{BACKUP_SUFFIX}")
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}-{counter}{BACKUP_SUFFIX}")
+        counter += 1
+    partial = path + ".part"
+
+    started = time.perf_counter()
+    pages = [0]
+
+    def on_step(status, remaining, total):
+        pages[0] = total
+        if progress:
+            progress(remaining, total)
+
+    source = connect(read_only=True)
+    target = sqlite3.connect(partial)
+    # integrity_check verifies the PERSIAN-collated indexes too
+    register_extensions(target)
+    try:
+        source.backup(target, pages=pages_per_step, progress=on_step, sleep=sleep)
+        integrity = [row[0] for row in target.execute("PRAGMA integrity_check;")]
+    except sqlite3.Error as e:
+        target.close()
+        os.remove(partial)
+        raise BackupError(str(e)) from e
+    finally:
+        source.close()
+    target.close()
+
+    if integrity != ["ok"]:
+        os.remove(partial)
+        raise BackupError("integrity_check failed: " + "; ".join(integrity[:5]))
+    os.replace(partial, path)
+    rotate_backups(backup_dir, keep)
+    return BackupResult(path, pages[0], time.perf_counter() - started, integrity[0])
+
+
+def backup_in_background(**kwargs):
+    """Run create_backup() on its own thread; returns a Future of BackupResult"""
+    future = Future()
+
+    def work():
+        try:
+            future.set_result(create_backup(**kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=work, name="db-backup", daemon=True).start()
+    return future
+
+
+class BackupScheduler(threading.Thread):
+    """Takes a backup every `interval` seconds until stopped"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, **backup_kwargs):
+        super().__init__(name="db-backup-scheduler", daemon=True)
+        self.interval = interval
+        self.backup_kwargs = backup_kwargs
+        self.last_result = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.last_result = create_backup(**self.backup_kwargs)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+_scheduler = None
+
+
+def start_backup_schedule(interval=DEFAULT_INTERVAL, **backup_kwargs):
+    """Take a backup every `interval` seconds on a background thread"""
+    global _scheduler
+    if _scheduler is not None or is_memory_database():
+        return
+    _scheduler = BackupScheduler(interval, **backup_kwargs)
+    _scheduler.start()
+
+
+def stop_backup_schedule():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
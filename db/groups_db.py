@@ -3,8 +3,13 @@
 Database operations for Groups
 """
 
-from db import fetch_all, execute
+from db import fetch_all, execute, execute_returning, transaction, UnitOfWork
+from db import fetch_page, iter_pages, is_unique_violation
+from db.members_db import move_members_to_group
 from utils.date_utils import get_current_persian_date, get_current_persian_datetime
+from utils.date_utils import day_start_epoch, jalali_month_range, persian_date_to_day
+from utils.date_utils import as_of_epoch, persian_datetime_to_epoch
+from utils.text_utils import normalize_name
 
 
 def get_all_groups():
@@ -14,12 +19,35 @@ def get_all_groups():
                COALESCE(m.full_name, '-') as leader_name,
                g.created_at
         FROM groups g
-        LEFT JOIN members m ON g.leader_member_id = m.id
+        LEFT JOIN members m ON g.leader_member_id = m.id AND m.deleted_at IS NULL
+        WHERE g.deleted_at IS NULL
         ORDER BY g.id DESC
     """
     return fetch_all(query)
 
 
+def get_groups_page(page_size=50, cursor=None, total=None):
+    """Fetch one page of groups (newest first) using a keyset cursor on id.
+
+    Pass the returned page's next_cursor to get the following page; `total`
+    is one of db.COUNT_STRATEGIES. Returns a db.Page.
+    """
+    select = """
+        SELECT g.id, g.name, g.leader_member_id,
+               COALESCE(m.full_name, '-') as leader_name,
+               g.created_at
+        FROM groups g
+        LEFT JOIN members m ON g.leader_member_id = m.id AND m.deleted_at IS NULL
+    """
+    return fetch_page(select, "groups g", ["g.deleted_at IS NULL"], page_size=page_size,
+                      cursor=cursor, total=total, id_column="g.id")
+
+
+def iter_groups_pages(page_size=200):
+    """Stream all groups page by page instead of loading the whole table"""
+    return iter_pages(get_groups_page, page_size)
+
+
 def get_group_by_id(group_id):
     """Fetch a single group by ID with leader name"""
     query = """
@@ -27,24 +55,94 @@ def get_group_by_id(group_id):
                COALESCE(m.full_name, '-') as leader_name,
                g.created_at
         FROM groups g
-        LEFT JOIN members m ON g.leader_member_id = m.id
-        WHERE g.id = ?
+        LEFT JOIN members m ON g.leader_member_id = m.id AND m.deleted_at IS NULL
+        WHERE g.id = ? AND g.deleted_at IS NULL
     """
     result = fetch_all(query, (group_id,))
     return result[0] if result else None
 
 
+def get_group_by_name(name):
+    """Fetch a group by name, ignoring Arabic/Persian letter, ZWNJ and spacing variants"""
+    query = """
+        SELECT g.id, g.name, g.leader_member_id,
+               COALESCE(m.full_name, '-') as leader_name,
+               g.created_at
+        FROM groups g
+        LEFT JOIN members m ON g.leader_member_id = m.id AND m.deleted_at IS NULL
+        WHERE g.name_norm = ? AND g.deleted_at IS NULL
+    """
+    result = fetch_all(query, (normalize_name(name),))
+    return result[0] if result else None
+
+
+def get_groups_created_between(start, end):
+    """Groups created from Jalali date `start` to `end` ('1404/11/01'), both inclusive.
+
+    A range scan of idx_groups_created_epoch, oldest first.
+    """
+    first, last = persian_date_to_day(start), persian_date_to_day(end)
+    if first is None or last is None:
+        return []
+    return _groups_created(first, last + 1)
+
+
+def get_groups_created_in_month(year=None, month=None):
+    """Groups created in a Jalali month (default: the current month)"""
+    if year is None or month is None:
+        year, month = (int(x) for x in get_current_persian_date().split("/")[:2])
+    return _groups_created(*jalali_month_range(year, month))
+
+
+def _groups_created(first_day, end_day):
+    """Groups created on day numbers first_day <= day < end_day (Afghanistan days)"""
+    query = """
+        SELECT g.id, g.name, g.leader_member_id,
+               COALESCE(m.full_name, '-') as leader_name,
+               g.created_at
+        FROM groups g
+        LEFT JOIN members m ON g.leader_member_id = m.id AND m.deleted_at IS NULL
+        WHERE g.created_epoch >= ? AND g.created_epoch < ? AND g.deleted_at IS NULL
+        ORDER BY g.created_epoch, g.id
+    """
+    return fetch_all(query, (day_start_epoch(first_day), day_start_epoch(end_day)))
+
+
+def get_group_roster_at(group_id, when):
+    """Members of a group as of a Jalali date (its end), timestamp or Unix time, by joining order.
+
+    Rows: (member_id, full_name, valid_from, valid_to); valid_to is None while it lasts.
+    """
+    moment = int(when) if isinstance(when, (int, float)) else as_of_epoch(when)
+    if moment is None:
+        return []
+    query = """
+        SELECT h.member_id, COALESCE(m.full_name, h.full_name) as full_name,
+               h.valid_from, h.valid_to
+        FROM membership_history h
+        LEFT JOIN members m ON m.id = h.member_id
+        WHERE h.group_id = ? AND h.valid_from <= ?
+          AND (h.valid_to IS NULL OR h.valid_to > ?)
+        ORDER BY h.valid_from
+    """
+    return fetch_all(query, (group_id, moment, moment))
+
+
 def add_group(name, leader_member_id=None):
     """Add a new group with Persian date"""
     query = """
-        INSERT INTO groups (name, leader_member_id, created_at)
-        VALUES (?, ?, ?)
+        INSERT INTO groups (name, leader_member_id, created_at, created_epoch)
+        VALUES (?, ?, ?, ?)
     """
     try:
         current_date = get_current_persian_datetime()
-        group_id = execute(query, (name, leader_member_id, current_date))
+        group_id = execute(query, (name, leader_member_id, current_date,
+                                   persian_datetime_to_epoch(current_date)))
         return True, group_id
     except Exception as e:
+        # The unique index on name decides, so two clerks cannot both win
+        if is_unique_violation(e, "groups.name_norm"):
+            return False, "گروهی با این نام قبلاً وجود دارد!"
         return False, str(e)
 
 
@@ -53,31 +151,72 @@ def update_group(group_id, name, leader_member_id=None):
     query = """
         UPDATE groups 
         SET name = ?, leader_member_id = ?
-        WHERE id = ?
+        WHERE id = ? AND deleted_at IS NULL
+        RETURNING id
     """
     try:
-        execute(query, (name, leader_member_id, group_id))
+        if not execute_returning(query, (name, leader_member_id, group_id)):
+            return False, "گروه یافت نشد"
         return True, "گروه با موفقیت بروز شد"
+    except Exception as e:
+        if is_unique_violation(e, "groups.name_norm"):
+            return False, "گروهی دیگر با این نام وجود دارد!"
+        return False, str(e)
+
+
+def set_group_leader(group_id, leader_member_id):
+    """Set (or clear, with None) the leader of a group"""
+    query = """
+        UPDATE groups SET leader_member_id = ?
+        WHERE id = ? AND deleted_at IS NULL
+        RETURNING id
+    """
+    try:
+        if not execute_returning(query, (leader_member_id, group_id)):
+            return False, "گروه یافت نشد"
+        return True, "رهبر گروه با موفقیت بروز شد"
+    except Exception as e:
+        return False, str(e)
+
+
+def create_group_with_members(name, member_ids, leader_member_id=None):
+    """Create a group, move members into it and set its leader in one transaction"""
+    try:
+        with UnitOfWork() as uow:
+            group_id = uow.call(add_group, name)
+            uow.call(move_members_to_group, member_ids, group_id)
+            if leader_member_id:
+                uow.call(set_group_leader, group_id, leader_member_id)
+        return True, group_id
     except Exception as e:
         return False, str(e)
 
 
 def delete_group(group_id):
-    """Delete a group (cascade deletes members)"""
-    query = "DELETE FROM groups WHERE id = ?"
+    """Soft-delete a group and its members; db.purger removes the rows later"""
+    deleted_at = get_current_persian_datetime()
     try:
-        execute(query, (group_id,))
+        with transaction():
+            if not execute_returning("UPDATE groups SET deleted_at = ? "
+                                     "WHERE id = ? AND deleted_at IS NULL RETURNING id",
+                                     (deleted_at, group_id)):
+                return False, "گروه یافت نشد"
+            execute("UPDATE members SET deleted_at = ? WHERE group_id = ? AND deleted_at IS NULL",
+                    (deleted_at, group_id))
         return True, "گروه با موفقیت حذف شد"
     except Exception as e:
         return False, str(e)
 
 
 def group_exists(name, exclude_id=None):
-    """Check if a group with this name already exists"""
+    """Check if a group with this name (compared Persian-normalized) already exists"""
     if exclude_id:
-        query = "SELECT COUNT(*) as cnt FROM groups WHERE name = ? AND id != ?"
-        result = fetch_all(query, (name, exclude_id))
+        query = """
+            SELECT COUNT(*) as cnt FROM groups
+            WHERE name_norm = ? AND id != ? AND deleted_at IS NULL
+        """
+        result = fetch_all(query, (normalize_name(name), exclude_id))
     else:
-        query = "SELECT COUNT(*) as cnt FROM groups WHERE name = ?"
-        result = fetch_all(query, (name,))
+        query = "SELECT COUNT(*) as cnt FROM groups WHERE name_norm = ? AND deleted_at IS NULL"
+        result = fetch_all(query, (normalize_name(name),))
     return result[0][0] > 0 if result else False
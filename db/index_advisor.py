@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+EXPLAIN QUERY PLAN index advisor for the repository queries
+
+Builds a populated throw-away database, runs every public function of
+db.groups_db and db.members_db against it (inside a transaction that is
+rolled back) while capturing the SQL they issue, then explains each
+captured query. Full table scans and temp B-tree sorts are flagged and a
+(covering) index is suggested for each.
+
+    python -m db.index_advisor            # report
+    python -m db.index_advisor --check    # exit 1 on new scans/sorts
+
+--check fails when a query produces a finding that is not listed in
+KNOWN_FINDINGS, or when a repository function has no entry in _workload()
+(so new queries cannot slip past the advisor unexplained).
+"""
+
+import argparse
+import inspect
+import random
+import re
+import sys
+from collections import namedtuple
+
+import db
+from db import groups_db, members_db
+from db.migrations import migrate
+
+MODULES = (groups_db, members_db)
+
+# Findings that are accepted as-is, keyed by (function, plan detail).
+KNOWN_FINDINGS = {
+    ("get_all_groups", "SCAN g"): "lists every group by design",
+    ("get_all_members", "SCAN m"): "lists every member by design",
+    ("get_member_choices", "SCAN members USING INDEX idx_members_full_name_fa"):
+        "lists every member by design, in index order",
+    ("search_members", "USE TEMP B-TREE FOR ORDER BY"):
+        "ranks only the full-text matches by bm25()",
+    ("find_member_by_phone", "USE TEMP B-TREE FOR ORDER BY"):
+        "sorts the few members sharing one number",
+}
+
+Finding = namedtuple("Finding", ["function", "query", "detail", "kind", "suggestion"])
+Call = namedtuple("Call", ["function", "query", "params"])
+
+_ALIAS_RE = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)"
+    r"(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|SET|LEFT|INNER|JOIN|ORDER|GROUP|LIMIT|VALUES)\b)(\w+))?",
+    re.IGNORECASE)
+_CLAUSE_END = r"(?=\bORDER\s+BY\b|\bGROUP\s+BY\b|\bLIMIT\b|\bRETURNING\b|$)"
+# The soft-delete marker matches (nearly) every row, so it does not make a
+# scan filtered and is no use as an index key.
+_SOFT_DELETE_RE = re.compile(r"\b(?:\w+\.)?deleted_at\s+IS\s+NULL\b", re.IGNORECASE)
+
+
+def populate(groups=500, members=20000, seed=1):
+    """Create the schema in the current database and fill it with synthetic rows"""
+    rnd = random.Random(seed)
+    migrate()
+    with db.transaction() as conn:
+        _insert_rows(conn, rnd, groups, members)
+
+
+def _insert_rows(conn, rnd, groups, members):
+    conn.executemany(
+        "INSERT INTO groups (id, name, created_at, created_epoch) "
+        "VALUES (?, ?, '1404/01/01 10:00:00', ?)",
+        [(i, f"group-{i}", 1710000000 + i * 3600) for i in range(1, groups + 1)])
+    conn.executemany(
+        "INSERT INTO members (id, group_id, full_name, phone, is_active, joined_at, joined_day) "
+        "VALUES (?, ?, ?, ?, ?, '1404/01/01', ?)",
+        [(i, rnd.randint(1, groups), f"member-{i}", f"07{i:08d}",
+          int(rnd.random() > 0.1), 19000 + i // 10) for i in range(1, members + 1)])
+    conn.execute("UPDATE groups SET leader_member_id = "
+                 "(SELECT MIN(id) FROM members WHERE group_id = groups.id)")
+    conn.execute("ANALYZE")
+
+
+def _workload():
+    """Representative calls for every repository function: name -> [(args, kwargs)]"""
+    return {
+        "get_all_groups": [((), {})],
+        "get_groups_page": [((), {"page_size": 50, "total": "exact"}),
+                            ((), {"page_size": 50, "cursor": 250})],
+        "iter_groups_pages": [((), {"page_size": 200})],
+        "get_group_by_id": [((10,), {})],
+        "get_group_by_name": [(("group-10",), {})],
+        "get_groups_created_between": [(("1402/12/20", "1402/12/25"), {})],
+        "get_groups_created_in_month": [((1403, 1), {})],
+        "get_group_roster_at": [((7, "1404/11/19"), {}), ((7, "1404/11/19 14:23:45"), {})],
+        "add_group": [(("advisor group",), {})],
+        "set_group_leader": [((10, 20), {})],
+        "create_group_with_members": [(("advisor group 2", [1, 2, 3], 1), {})],
+        "update_group": [((10, "renamed group", 20), {})],
+        "delete_group": [((11,), {})],
+        "group_exists": [(("group-5",), {}), (("group-5", 5), {})],
+        "get_all_members": [((), {})],
+        "get_members_page": [((), {"page_size": 50}),
+                             ((), {"page_size": 50, "cursor": 10000, "group_id": 7}),
+                             ((), {"page_size": 50, "is_active": 0, "total": "exact"})],
+        "get_members_page_by_name": [((), {"page_size": 50}),
+                                     ((), {"page_size": 50, "cursor": ("member-500", 500)}),
+                                     ((), {"page_size": 50, "group_id": 7,
+                                           "cursor": ("member-500", 500)})],
+        "iter_members_pages_by_name": [((), {"page_size": 500, "group_id": 7})],
+        "iter_members_pages": [((), {"page_size": 500, "group_id": 7}),
+                               ((), {"page_size": 500, "is_active": 0})],
+        "get_member_by_id": [((100,), {})],
+        "get_member_by_name": [(("member-100",), {})],
+        "get_members_by_group": [((7,), {})],
+        "get_member_choices": [((), {})],
+        "search_members": [(("member 07", 50), {})],
+        "find_possible_duplicates": [(("member-1000",), {})],
+        "find_member_by_phone": [(("+93 700 000 100",), {})],
+        "get_members_joined_between": [(("1401/01/01", "1401/01/07"), {})],
+        "get_members_joined_in_month": [((1401, 1), {})],
+        "get_member_group_history": [((100,), {})],
+        "add_member": [(("advisor member", 7, "0700000000"), {})],
+        "update_member": [((100, "member-100", 8, "0700000100", 1), {})],
+        "delete_member": [((101,), {})],
+        "member_exists": [(("member-5",), {}), (("member-5", 5), {})],
+        "move_members_to_group": [(([200, 201, 202], 9), {})],
+        "toggle_member_active": [((300, 0), {})],
+    }
+
+
+def repository_functions():
+    """Public functions defined in the repository modules"""
+    for module in MODULES:
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ == module.__name__ and not name.startswith("_"):
+                yield name, func
+
+
+class _Rollback(Exception):
+    pass
+
+
+def capture_queries(workload=None):
+    """Run the workload and return (calls, uncovered function names)"""
+    workload = _workload() if workload is None else workload
+    calls, uncovered = [], []
+    current = [None]
+
+    def observer(query, params, seconds, rowcount):
+        calls.append(Call(current[0], query, tuple(params)))
+
+    previous = db.root_db._query_observer
+    db.set_query_observer(observer)
+    try:
+        with db.transaction():
+            for name, func in repository_functions():
+                if name not in workload:
+                    uncovered.append(name)
+                    continue
+                current[0] = name
+                # Each call in its own savepoint so a failing write does not
+                # disturb the data the next function sees.
+                for args, kwargs in workload[name]:
+                    try:
+                        with db.transaction():
+                            result = func(*args, **kwargs)
+                            if inspect.isgenerator(result):
+                                list(result)
+                            raise _Rollback
+                    except _Rollback:
+                        pass
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        db.set_query_observer(previous)
+
+    unique, seen = [], set()
+    for call in calls:
+        key = (call.function, call.query)
+        if key not in seen:
+            seen.add(key)
+            unique.append(call)
+    return unique, uncovered
+
+
+def explain(conn, query, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+def _aliases(query):
+    """Map alias (or bare table name) -> table name"""
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(query):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def _columns(text, alias, single_table):
+    """Columns of `alias` referenced in a SQL fragment"""
+    prefix = rf"\b{alias}\." if not single_table else rf"(?:\b{alias}\.|(?<![\w.]))"
+    return re.findall(prefix + r"(\w+)\b", text)
+
+
+def suggest_index(query, detail, conn):
+    """Suggest a (covering) index for a scanned/sorted table in `query`"""
+    match = re.match(r"(?:SCAN|SEARCH) (\w+)", detail)
+    aliases = _aliases(query)
+    if match:
+        alias = match.group(1)
+    elif len(set(aliases.values())) == 1:
+        alias = next(iter(aliases))
+    else:
+        return None
+    table = aliases.get(alias, alias)
+    known = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    rowid = {row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[5]}
+    single = len(set(aliases.values())) == 1
+
+    def cols(pattern):
+        found = []
+        for part in re.findall(pattern, query, re.IGNORECASE | re.DOTALL):
+            for col in _columns(part, alias, single):
+                if col in known and col not in rowid and col not in found:
+                    found.append(col)
+        return found
+
+    query = _SOFT_DELETE_RE.sub("1", query)
+    where = rf"\bWHERE\b(.*?){_CLAUSE_END}"
+    equality = [c for c in cols(where)
+                if re.search(rf"\b{c}\s*(?:=|\bIN\b|\bIS\b)(?!=)", query, re.IGNORECASE)]
+    ranged = [c for c in cols(where) if c not in equality]
+    # Join columns only matter when the scanned table is the inner side
+    joined = re.search(rf"\bJOIN\s+{table}(?:\s+(?:AS\s+)?{alias})?\b", query, re.IGNORECASE)
+    join = cols(r"\bON\b(.*?)(?=\bLEFT\b|\bJOIN\b|\bWHERE\b|\bORDER\b|$)") if joined else []
+    order = cols(r"\bORDER\s+BY\b(.*?)(?=\bLIMIT\b|$)")
+    key = []
+    for col in equality + join + ranged[:1] + order:
+        if col not in key:
+            key.append(col)
+    if not key:
+        return None
+    selected = [c for c in cols(r"\bSELECT\b(.*?)\bFROM\b") if c not in key]
+    name = f"idx_{table}_{'_'.join(key)}"
+    suggestion = f"CREATE INDEX {name} ON {table}({', '.join(key)});"
+    if selected:
+        covering = ", ".join(key + selected)
+        suggestion += f"  -- covering: CREATE INDEX {name}_cov ON {table}({covering});"
+    return suggestion
+
+
+def _has_filter(query, alias, single, rowid, known):
+    query = _SOFT_DELETE_RE.sub("1", query)
+    where = re.findall(rf"\bWHERE\b(.*?){_CLAUSE_END}", query, re.IGNORECASE | re.DOTALL)
+    cols = [c for part in where for c in _columns(part, alias, single) if c in known]
+    return any(c not in rowid for c in cols)
+
+
+def analyse(conn, calls):
+    """Explain every captured call and return (plans, findings)"""
+    plans, findings = [], []
+    for call in calls:
+        if call.query.lstrip().upper().startswith(("PRAGMA", "BEGIN", "SAVEPOINT", "RELEASE")):
+            continue
+        details = explain(conn, call.query, call.params)
+        plans.append((call, details))
+        aliases = _aliases(call.query)
+        single = len(set(aliases.values())) == 1
+        for detail in details:
+            kind = None
+            if detail.startswith("USE TEMP B-TREE"):
+                kind = "temp-btree"
+            elif " VIRTUAL TABLE INDEX " in detail and not detail.endswith(" INDEX 0:"):
+                # Served by the module's own index (FTS5 MATCH, fts5vocab
+                # term lookups), which CREATE INDEX cannot improve
+                pass
+            elif detail.startswith("SCAN ") and not detail.startswith("SCAN CONSTANT"):
+                alias = detail.split()[1]
+                table = aliases.get(alias, alias)
+                info = list(conn.execute(f"PRAGMA table_info({table})"))
+                known = {row[1] for row in info}
+                rowid = {row[1] for row in info if row[5]}
+                filtered = _has_filter(call.query, alias, single, rowid, known)
+                # A LIMITed scan in rowid order stops after one page, and an
+                # unfiltered COUNT(*) has to visit every row whatever the index.
+                bounded = re.search(r"\bLIMIT\b", call.query, re.IGNORECASE)
+                counting = re.match(r"\s*SELECT\s+COUNT\(\*\)", call.query, re.IGNORECASE)
+                kind = None if (bounded or counting) and not filtered else "full-scan"
+            if kind:
+                finding = Finding(call.function, call.query, detail, kind,
+                                  suggest_index(call.query, detail, conn))
+                if not any((f.function, f.detail, f.suggestion) ==
+                           (finding.function, finding.detail, finding.suggestion)
+                           for f in findings):
+                    findings.append(finding)
+    return plans, findings
+
+
+def run(groups=500, members=20000, verbose=True):
+    """Populate an in-memory database, analyse all repository queries, print a report"""
+    with db.isolated_database(db.MEMORY):
+        populate(groups, members)
+        calls, uncovered = capture_queries()
+        plans, findings = analyse(db.get_conn(), calls)
+
+    if verbose:
+        for call, details in plans:
+            shape = " ".join(call.query.split())
+            print(f"[{call.function}] {shape}")
+            for detail in details:
+                print(f"    {detail}")
+        print()
+        if findings:
+            print("Findings:")
+        for f in findings:
+            status = "known" if (f.function, f.detail) in KNOWN_FINDINGS else "NEW"
+            print(f"  {status:<5} {f.kind:<10} {f.function}: {f.detail}")
+            if f.suggestion:
+                print(f"        suggest: {f.suggestion}")
+        for name in uncovered:
+            print(f"  NEW   uncovered  {name}: add it to the advisor _workload()")
+    return findings, uncovered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN index advisor")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 if a query has a finding not in KNOWN_FINDINGS")
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--members", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    findings, uncovered = run(args.groups, args.members, verbose=True)
+    new = [f for f in findings if (f.function, f.detail) not in KNOWN_FINDINGS]
+    if args.check and (new or uncovered):
+        print(f"\n{len(new)} new finding(s), {len(uncovered)} uncovered function(s)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in query timing for the db layer
+
+enable_instrumentation() installs an observer on db.fetch_all/db.execute
+that groups queries by shape (whitespace collapsed, literals and IN lists
+replaced by placeholders) and keeps call counts, row counts and a latency
+histogram per shape. Queries slower than the threshold are written to a
+rotating slow-query log, by shape and without their parameters, so member
+names and phone numbers stay out of it. When disabled the query path only
+checks one module global.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from db import set_query_observer
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+
+_SLOW_LOGGER_NAME = "sandoq.db.slow_queries"
+
+
+def query_shape(query):
+    """Normalise a SQL string so calls that differ only in literals share a shape"""
+    shape = _STRING_LITERAL.sub("?", query)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _WHITESPACE.sub(" ", shape).strip()
+    return _IN_LIST.sub("IN (?...)", shape)
+
+
+# The same query strings repeat constantly. Bounded: every IN-list length
+# and every generated MATCH/IN query is a different string.
+_cached_shape = lru_cache(maxsize=512)(query_shape)
+
+
+class QueryShapeStats:
+    """Counters for one query shape"""
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, rowcount):
+        self.calls += 1
+        if rowcount < 0:
+            self.errors += 1
+        else:
+            self.rows += rowcount
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def as_dict(self):
+        labels = [f"<={b}ms" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"]
+        return {
+            "shape": self.shape,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "histogram": dict(zip(labels, self.histogram)),
+        }
+
+
+class QueryInstrumentation:
+    """Query observer collecting per-shape stats and logging slow queries"""
+
+    def __init__(self, slow_query_ms=100.0, log_path=None,
+                 max_bytes=1024 * 1024, backup_count=5):
+        self.slow_query_ms = slow_query_ms
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow_log = None
+        if log_path:
+            log_dir = os.path.dirname(log_path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._slow_log = logging.getLogger(_SLOW_LOGGER_NAME)
+            self._slow_log.setLevel(logging.WARNING)
+            self._slow_log.propagate = False
+            self._slow_log.addHandler(handler)
+            self._handler = handler
+
+    def __call__(self, query, params, seconds, rowcount):
+        elapsed_ms = seconds * 1000.0
+        shape = _cached_shape(query)
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = QueryShapeStats(shape)
+            stats.record(elapsed_ms, rowcount)
+        if self._slow_log is not None and elapsed_ms >= self.slow_query_ms:
+            self._slow_log.warning("%.1f ms rows=%d %s params=%d",
+                                   elapsed_ms, rowcount, shape, len(params))
+
+    def stats(self):
+        with self._lock:
+            items = [s.as_dict() for s in self._stats.values()]
+        return sorted(items, key=lambda s: s["total_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        self.started_at = time.time()
+
+    def close(self):
+        if self._slow_log is not None:
+            self._slow_log.removeHandler(self._handler)
+            self._handler.close()
+            self._slow_log = None
+
+
+_instrumentation = None
+
+
+def enable_instrumentation(slow_query_ms=100.0, log_path="logs/slow_queries.log",
+                           max_bytes=1024 * 1024, backup_count=5):
+    """Start collecting query stats; queries >= slow_query_ms go to log_path"""
+    global _instrumentation
+    disable_instrumentation()
+    _instrumentation = QueryInstrumentation(slow_query_ms, log_path, max_bytes, backup_count)
+    set_query_observer(_instrumentation)
+    return _instrumentation
+
+
+def disable_instrumentation():
+    """Stop collecting; the query path goes back to zero overhead"""
+    global _instrumentation
+    set_query_observer(None)
+    if _instrumentation is not None:
+        _instrumentation.close()
+        _instrumentation = None
+
+
+def is_enabled():
+    return _instrumentation is not None
+
+
+def get_query_stats():
+    """Per-shape stats, slowest total time first (empty when disabled)"""
+    return _instrumentation.stats() if _instrumentation else []
+
+
+def reset_query_stats():
+    if _instrumentation:
+        _instrumentation.reset()
+
+
+def dump_query_stats(path=None):
+    """Return the stats as JSON, also writing them to `path` when given"""
+    report = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S",
+                                    time.localtime(_instrumentation.started_at))
+        if _instrumentation else None,
+        "dumped_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "slow_query_ms": _instrumentation.slow_query_ms if _instrumentation else None,
+        "queries": get_query_stats(),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Database maintenance: planner statistics, free space and fragmentation
+
+SQLite's query planner relies on the statistics ANALYZE stores in
+sqlite_stat1, which go stale after bulk imports and deletes; deleted rows
+leave free pages behind that the file never gives back on its own. This
+module:
+
+- runs ANALYZE once at least `change_threshold` rows changed since the
+  last run, and the cheap PRAGMA optimize otherwise;
+- returns free pages to the file system with PRAGMA incremental_vacuum
+  (new databases are created with auto_vacuum=INCREMENTAL, see
+  STORAGE_PROFILE in db.py; an older database is converted once, with a
+  full VACUUM, the next time maintenance runs at shutdown);
+- reports page statistics and per-table fragmentation (page_stats()).
+
+Maintenance never runs at startup. start_maintenance_schedule() runs it
+on a background thread once the writer has been idle for `idle_seconds`,
+and the app calls shutdown_maintenance() on exit.
+
+Usage: python -m db.maintenance [--db PATH] [--run]
+"""
+
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from db import add_database_argument, connect, get_write_stats, is_memory_database, use_database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANGE_THRESHOLD = 1000
+DEFAULT_IDLE_SECONDS = 120.0
+DEFAULT_CHECK_INTERVAL = 30.0
+# Pages returned per incremental_vacuum call, so one run holds the write
+# lock only briefly; whatever is left is freed by the next run.
+DEFAULT_VACUUM_PAGES = 2048
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+PageStats = namedtuple("PageStats", [
+    "page_size", "page_count", "freelist_count", "free_ratio", "auto_vacuum", "objects"])
+ObjectStats = namedtuple("ObjectStats", ["name", "pages", "unused_bytes", "fragmentation"])
+MaintenanceReport = namedtuple("MaintenanceReport", [
+    "analyzed", "changes", "freed_pages", "vacuumed", "before", "after", "seconds"])
+
+
+def page_stats(conn=None, per_object=True):
+    """Page counts, free pages and (if dbstat is available) per-object fragmentation.
+
+    An object's fragmentation is the share of its leaf pages that do not
+    directly follow the previous leaf in the file, i.e. how far a full
+    scan of it is from a sequential read.
+    """
+    own = conn is None
+    if own:
+        conn = connect(read_only=True)
+    try:
+        page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count;").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+        objects = _object_stats(conn) if per_object else None
+    finally:
+        if own:
+            conn.close()
+    free_ratio = freelist_count / page_count if page_count else 0.0
+    return PageStats(page_size, page_count, freelist_count, free_ratio,
+                     AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)), objects)
+
+
+def _object_stats(conn):
+    """ObjectStats per table/index from the dbstat virtual table, or None"""
+    try:
+        rows = conn.execute("SELECT name, pageno, pagetype, unused FROM dbstat;").fetchall()
+    except sqlite3.OperationalError:
+        return None  # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+    totals = {}
+    for name, pageno, pagetype, unused in rows:
+        entry = totals.setdefault(name, [0, 0, 0, 0, None])  # pages, unused, leaves, jumps, last
+        entry[0] += 1
+        entry[1] += unused
+        if pagetype == "leaf":
+            # dbstat walks each b-tree in key order
+            if entry[4] is not None and pageno != entry[4] + 1:
+                entry[3] += 1
+            entry[2] += 1
+            entry[4] = pageno
+    return sorted((ObjectStats(name, pages, unused, jumps / (leaves - 1) if leaves > 1 else 0.0)
+                   for name, (pages, unused, leaves, jumps, _) in totals.items()),
+                  key=lambda stats: -stats.pages)
+
+
+_state_lock = threading.Lock()
+_changes_at_last_run = 0
+
+
+def changes_since_maintenance():
+    """Rows changed through the writer since maintenance last ran"""
+    with _state_lock:
+        return max(0, get_write_stats()["changes"] - _changes_at_last_run)
+
+
+def run_maintenance(change_threshold=DEFAULT_CHANGE_THRESHOLD,
+                    vacuum_pages=DEFAULT_VACUUM_PAGES, shutdown=False, analyze=None):
+    """Refresh planner statistics and reclaim free pages; returns a MaintenanceReport.
+
+    `analyze` forces (True) or skips (False) the full ANALYZE; by default it
+    runs when at least `change_threshold` rows changed since the last run.
+    With shutdown=True a database still on auto_vacuum=NONE is converted to
+    INCREMENTAL with a full VACUUM, which rewrites the whole file.
+    """
+    global _changes_at_last_run
+    started = time.perf_counter()
+    with _state_lock:
+        total_changes = get_write_stats()["changes"]
+        changes = max(0, total_changes - _changes_at_last_run)
+        conn = connect()
+        try:
+            before = page_stats(conn, per_object=False)
+            if analyze is None:
+                has_stats = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1';").fetchone()
+                analyze = changes >= change_threshold or not has_stats
+            if analyze:
+                conn.execute("ANALYZE;")
+            # Re-analyses only what the planner considers stale
+            conn.execute("PRAGMA optimize;")
+            conn.commit()
+
+            vacuumed = False
+            if before.auto_vacuum == "INCREMENTAL" and before.freelist_count:
+                conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)});").fetchall()
+                conn.commit()
+            elif before.auto_vacuum == "NONE" and shutdown:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+                conn.execute("VACUUM;")
+                vacuumed = True
+            after = page_stats(conn, per_object=False)
+            freed = max(0, before.page_count - after.page_count)
+        finally:
+            conn.close()
+        _changes_at_last_run = total_changes
+
+    report = MaintenanceReport(bool(analyze), changes, freed, vacuumed, before, after,
+                               time.perf_counter() - started)
+    logger.info("maintenance: %d changes, analyze=%s, %d pages freed%s in %.3f s",
+                changes, report.analyzed, freed, " (VACUUM)" if vacuumed else "",
+                report.seconds)
+    return report
+
+
+class MaintenanceScheduler(threading.Thread):
+    """Runs maintenance once enough rows changed and the writer has gone idle"""
+
+    def __init__(self, change_threshold=DEFAULT_CHANGE_THRESHOLD,
+                 idle_seconds=DEFAULT_IDLE_SECONDS, check_interval=DEFAULT_CHECK_INTERVAL):
+        super().__init__(name="db-maintenance", daemon=True)
+        self.change_threshold = change_threshold
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.last_report = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_commits = get_write_stats()["commits"]
+        idle_since = time.monotonic()
+        while not self._stop_event.wait(self.check_interval):
+            commits = get_write_stats()["commits"]
+            if commits != last_commits:
+                last_commits = commits
+                idle_since = time.monotonic()
+                continue
+            if (time.monotonic() - idle_since < self.idle_seconds
+                    or changes_since_maintenance() < self.change_threshold):
+                continue
+            try:
+                self.last_report = run_maintenance(self.change_threshold)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                logger.warning("maintenance failed: %s", e)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+_scheduler = None
+
+
+def start_maintenance_schedule(change_threshold=DEFAULT_CHANGE_THRESHOLD,
+                               idle_seconds=DEFAULT_IDLE_SECONDS,
+                               check_interval=DEFAULT_CHECK_INTERVAL):
+    """Run maintenance on a background thread whenever the writer goes idle"""
+    global _scheduler
+    if _scheduler is not None or is_memory_database():
+        return
+    _scheduler = MaintenanceScheduler(change_threshold, idle_seconds, check_interval)
+    _scheduler.start()
+
+
+def stop_maintenance_schedule():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
+
+
+def shutdown_maintenance():
+    """Stop the scheduler and run a last maintenance pass (call before close_all)"""
+    stop_maintenance_schedule()
+    if is_memory_database():
+        return None
+    try:
+        return run_maintenance(shutdown=True)
+    except sqlite3.Error as e:
+        logger.warning("maintenance at shutdown failed: %s", e)
+        return None
+
+
+def print_stats(stats):
+    print(f"page size      {stats.page_size} bytes")
+    print(f"pages          {stats.page_count} "
+          f"({stats.page_count * stats.page_size / 1024 / 1024:.1f} MB)")
+    print(f"free pages     {stats.freelist_count} ({stats.free_ratio:.1%})")
+    print(f"auto_vacuum    {stats.auto_vacuum}")
+    if stats.objects is None:
+        print("(per-object statistics need SQLite built with dbstat)")
+        return
+    print()
+    print(f"{'object':<36} {'pages':>8} {'unused KB':>10} {'fragmented':>10}")
+    for obj in stats.objects:
+        print(f"{obj.name:<36} {obj.pages:>8} {obj.unused_bytes / 1024:>10.1f} "
+              f"{obj.fragmentation:>10.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database page statistics and maintenance")
+    add_database_argument(parser)
+    parser.add_argument("--run", action="store_true",
+                        help="run ANALYZE, incremental vacuum (or the one-off VACUUM) first")
+    args = parser.parse_args(argv)
+    if args.db:
+        use_database(args.db)
+
+    if args.run:
+        report = run_maintenance(shutdown=True, analyze=True)
+        print(f"maintenance: {report.freed_pages} pages freed"
+              f"{', converted with VACUUM' if report.vacuumed else ''} "
+              f"in {report.seconds:.3f} s\n")
+    print_stats(page_stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,8 +3,19 @@
 Database operations for Members
 """
 
-from db import fetch_all, execute
+import re
+
+from db import fetch_all, execute_returning, fetch_page, fetch_sorted_page, iter_pages
+from db import is_unique_violation, is_foreign_key_violation
 from utils.date_utils import get_current_persian_date, get_current_persian_datetime
+from utils.date_utils import jalali_month_range, persian_date_to_day
+from utils.text_utils import key_ngrams, min_overlap, name_ngrams, ngram_similarity
+from utils.text_utils import normalize_name, normalize_phone, normalize_search
+
+# bm25() column weights for members_fts: name, phone, group name
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+# Name trigram similarity (Jaccard) from which two members may be the same person
+DUPLICATE_THRESHOLD = 0.5
 
 
 def get_all_members():
@@ -14,11 +25,64 @@ def get_all_members():
                m.phone, m.is_active, m.joined_at
         FROM members m
         LEFT JOIN groups g ON m.group_id = g.id
+        WHERE m.deleted_at IS NULL
         ORDER BY m.id DESC
     """
     return fetch_all(query)
 
 
+def get_members_page(page_size=50, cursor=None, group_id=None, is_active=None,
+                     total=None):
+    """Fetch one page of members (newest first) using a keyset cursor on id.
+
+    Optional filters: group_id and is_active. Pass the returned page's
+    next_cursor to get the following page; `total` is one of
+    db.COUNT_STRATEGIES. Returns a db.Page.
+    """
+    select = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members m
+        LEFT JOIN groups g ON m.group_id = g.id
+    """
+    conditions, params = ["m.deleted_at IS NULL"], []
+    if group_id is not None:
+        conditions.append("m.group_id = ?")
+        params.append(group_id)
+    if is_active is not None:
+        conditions.append("m.is_active = ?")
+        params.append(int(is_active))
+    return fetch_page(select, "members m", conditions, params, page_size=page_size,
+                      cursor=cursor, total=total, id_column="m.id")
+
+
+def iter_members_pages(page_size=200, group_id=None, is_active=None):
+    """Stream members page by page instead of loading the whole table"""
+    return iter_pages(get_members_page, page_size, group_id=group_id, is_active=is_active)
+
+
+def get_members_page_by_name(page_size=50, cursor=None, group_id=None, total=None):
+    """Fetch one page of members in Persian alphabetical order (cursor: (name, id))"""
+    select = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members m
+        LEFT JOIN groups g ON m.group_id = g.id
+    """
+    conditions, params = ["m.deleted_at IS NULL"], []
+    if group_id is not None:
+        conditions.append("m.group_id = ?")
+        params.append(group_id)
+    return fetch_sorted_page(select, "members m", "m.full_name COLLATE PERSIAN", conditions,
+                             params, page_size=page_size, cursor=cursor, total=total,
+                             id_column="m.id")
+
+
+def iter_members_pages_by_name(page_size=200, group_id=None):
+    """Stream members in Persian alphabetical order, page by page"""
+    return iter_pages(get_members_page_by_name, page_size, group_id=group_id)
+
+
 def get_member_by_id(member_id):
     """Fetch a single member by ID"""
     query = """
@@ -26,35 +90,214 @@ def get_member_by_id(member_id):
                m.phone, m.is_active, m.joined_at
         FROM members m
         LEFT JOIN groups g ON m.group_id = g.id
-        WHERE m.id = ?
+        WHERE m.id = ? AND m.deleted_at IS NULL
     """
     result = fetch_all(query, (member_id,))
     return result[0] if result else None
 
 
+def get_member_by_name(full_name):
+    """Fetch a member by name, ignoring Arabic/Persian letter, ZWNJ and spacing variants"""
+    query = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members m
+        LEFT JOIN groups g ON m.group_id = g.id
+        WHERE m.full_name_norm = ? AND m.deleted_at IS NULL
+    """
+    result = fetch_all(query, (normalize_name(full_name),))
+    return result[0] if result else None
+
+
+# A phone number as typed: digits with separators, e.g. "+93 799-123 456"
+_PHONE_IN_QUERY = re.compile(r"\+?\d(?:[\d \-().\/]*\d)?")
+
+
+def _search_expression(query):
+    """FTS5 MATCH expression: every word of `query` as a prefix, all required.
+
+    Numbers become one normalize_phone() word, as stored in members_fts.phone.
+    """
+    text = _PHONE_IN_QUERY.sub(lambda match: f" {normalize_phone(match.group())} ",
+                               normalize_search(query or ""))
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_members(query, limit=50):
+    """Members whose name, phone or group name match every word of `query`, best first"""
+    expression = _search_expression(query)
+    if not expression:
+        return []
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    sql = f"""
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members_fts f
+        JOIN members m ON m.id = f.rowid
+        LEFT JOIN groups g ON m.group_id = g.id
+        WHERE members_fts MATCH ? AND m.deleted_at IS NULL
+        ORDER BY bm25(members_fts, {weights}), m.id DESC
+        LIMIT ?
+    """
+    return fetch_all(sql, (expression, limit))
+
+
+def find_possible_duplicates(full_name, exclude_id=None, threshold=DUPLICATE_THRESHOLD,
+                             limit=10):
+    """Members with names similar to `full_name`, most similar first (plus the 0-1 similarity)"""
+    grams = name_ngrams(full_name)
+    if not grams:
+        return []
+    placeholders = ", ".join("?" * len(grams))
+    counts = dict(fetch_all(
+        f"SELECT term, doc FROM members_ngram_vocab WHERE term IN ({placeholders})",
+        tuple(grams)))
+    # A name at least `threshold` similar shares one of the rarest trigrams
+    probe_size = len(grams) - min_overlap(threshold, len(grams)) + 1
+    probe = [gram for gram in sorted(grams, key=lambda g: (counts.get(g, 0), g))[:probe_size]
+             if counts.get(gram)]
+    if not probe:
+        return []
+    expression = " OR ".join('"{}"'.format(gram.replace('"', '""')) for gram in probe)
+    query = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at, m.full_name_norm
+        FROM members_ngram n
+        JOIN members m ON m.id = n.rowid
+        LEFT JOIN groups g ON m.group_id = g.id
+        WHERE members_ngram MATCH ? AND m.deleted_at IS NULL
+    """
+    matches = []
+    for row in fetch_all(query, (expression,)):
+        if row[0] == exclude_id:
+            continue
+        similarity = ngram_similarity(grams, key_ngrams(row[7]))
+        if similarity >= threshold:
+            matches.append((*row[:7], round(similarity, 3)))
+    matches.sort(key=lambda match: (-match[7], match[0]))
+    return matches[:limit]
+
+
+def find_member_by_phone(phone):
+    """Members with this phone number in any spelling (+93, 0093, 07..., Persian digits).
+
+    An index lookup on members.phone_norm. Usually one row, but relatives
+    may share a number; oldest member first.
+    """
+    key = normalize_phone(phone)
+    if key is None:
+        return []
+    query = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members m
+        LEFT JOIN groups g ON m.group_id = g.id
+        WHERE m.phone_norm = ? AND m.deleted_at IS NULL
+        ORDER BY m.id
+    """
+    return fetch_all(query, (key,))
+
+
+def get_members_joined_between(start, end):
+    """Members who joined from Jalali date `start` to `end` ('1404/11/01'), both inclusive.
+
+    A range scan of idx_members_joined_day, in joining order.
+    """
+    first, last = persian_date_to_day(start), persian_date_to_day(end)
+    if first is None or last is None:
+        return []
+    return _members_joined(first, last + 1)
+
+
+def get_members_joined_in_month(year=None, month=None):
+    """Members who joined in a Jalali month (default: the current month)"""
+    if year is None or month is None:
+        year, month = (int(x) for x in get_current_persian_date().split("/")[:2])
+    return _members_joined(*jalali_month_range(year, month))
+
+
+def _members_joined(first_day, end_day):
+    query = """
+        SELECT m.id, m.full_name, m.group_id, g.name as group_name,
+               m.phone, m.is_active, m.joined_at
+        FROM members m
+        LEFT JOIN groups g ON m.group_id = g.id
+        WHERE m.joined_day >= ? AND m.joined_day < ? AND m.deleted_at IS NULL
+        ORDER BY m.joined_day, m.id
+    """
+    return fetch_all(query, (first_day, end_day))
+
+
+def get_member_group_history(member_id):
+    """Groups a member has been in, oldest first (including deleted members).
+
+    Rows: (group_id, group_name, valid_from, valid_to), Unix times of each
+    membership; valid_to is None for the current one. group_name is None
+    for purged groups.
+    """
+    query = """
+        SELECT h.group_id, g.name as group_name, h.valid_from, h.valid_to
+        FROM membership_history h
+        LEFT JOIN groups g ON g.id = h.group_id
+        WHERE h.member_id = ?
+        ORDER BY h.valid_from, h.id
+    """
+    return fetch_all(query, (member_id,))
+
+
+def get_member_choices():
+    """Fetch (id, full_name) of all members ordered by name, e.g. for combo boxes"""
+    query = """
+        SELECT id, full_name FROM members
+        WHERE deleted_at IS NULL
+        ORDER BY full_name COLLATE PERSIAN
+    """
+    return fetch_all(query)
+
+
 def get_members_by_group(group_id):
     """Fetch all members in a specific group"""
     query = """
         SELECT id, full_name, phone, is_active, joined_at
         FROM members
-        WHERE group_id = ?
-        ORDER BY full_name
+        WHERE group_id = ? AND deleted_at IS NULL
+        ORDER BY full_name COLLATE PERSIAN
     """
     return fetch_all(query, (group_id,))
 
 
+def _write_error(error, duplicate_message):
+    """Message for a failed member write; constraint failures get their Persian text"""
+    if is_unique_violation(error, "members.full_name_norm"):
+        return duplicate_message
+    if is_foreign_key_violation(error):
+        return "گروه انتخاب شده وجود ندارد!"
+    return str(error)
+
+
+def _group_is_live(group_id):
+    return bool(fetch_all("SELECT 1 FROM groups WHERE id = ? AND deleted_at IS NULL",
+                          (group_id,)))
+
+
 def add_member(full_name, group_id, phone=None):
     """Add a new member with Persian date"""
     query = """
-        INSERT INTO members (full_name, group_id, phone, joined_at)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO members (full_name, group_id, phone, joined_at, joined_day)
+        SELECT ?, ?, ?, ?, ?
+        WHERE EXISTS (SELECT 1 FROM groups WHERE id = ? AND deleted_at IS NULL)
+        RETURNING id
     """
     try:
         joined_date = get_current_persian_date()
-        member_id = execute(query, (full_name, group_id, phone, joined_date))
-        return True, member_id
+        rows = execute_returning(query, (full_name, group_id, phone, joined_date,
+                                         persian_date_to_day(joined_date), group_id))
+        if not rows:
+            return False, "گروه انتخاب شده وجود ندارد!"
+        return True, rows[0][0]
     except Exception as e:
-        return False, str(e)
+        return False, _write_error(e, "عضوی با این نام قبلاً وجود دارد!")
 
 
 def update_member(member_id, full_name, group_id, phone=None, is_active=1):
@@ -62,41 +305,85 @@ def update_member(member_id, full_name, group_id, phone=None, is_active=1):
     query = """
         UPDATE members 
         SET full_name = ?, group_id = ?, phone = ?, is_active = ?
-        WHERE id = ?
+        WHERE id = ? AND deleted_at IS NULL
+          AND EXISTS (SELECT 1 FROM groups WHERE id = ? AND deleted_at IS NULL)
+        RETURNING id
     """
     try:
-        execute(query, (full_name, group_id, phone, is_active, member_id))
+        if not execute_returning(query, (full_name, group_id, phone, is_active, member_id,
+                                         group_id)):
+            if not _group_is_live(group_id):
+                return False, "گروه انتخاب شده وجود ندارد!"
+            return False, "عضو یافت نشد"
         return True, "عضو با موفقیت بروز شد"
     except Exception as e:
-        return False, str(e)
+        return False, _write_error(e, "عضوی دیگر با این نام وجود دارد!")
 
 
 def delete_member(member_id):
-    """Delete a member (cascade deletes related data)"""
-    query = "DELETE FROM members WHERE id = ?"
+    """Soft-delete a member; db.purger removes the row (and related data) later"""
+    query = """
+        UPDATE members SET deleted_at = ?
+        WHERE id = ? AND deleted_at IS NULL
+        RETURNING id
+    """
     try:
-        execute(query, (member_id,))
+        if not execute_returning(query, (get_current_persian_datetime(), member_id)):
+            return False, "عضو یافت نشد"
         return True, "عضو با موفقیت حذف شد"
     except Exception as e:
         return False, str(e)
 
 
 def member_exists(full_name, exclude_id=None):
-    """Check if a member with this name already exists"""
+    """Check if a member with this name (compared Persian-normalized) already exists"""
     if exclude_id:
-        query = "SELECT COUNT(*) as cnt FROM members WHERE full_name = ? AND id != ?"
-        result = fetch_all(query, (full_name, exclude_id))
+        query = """
+            SELECT COUNT(*) as cnt FROM members
+            WHERE full_name_norm = ? AND id != ? AND deleted_at IS NULL
+        """
+        result = fetch_all(query, (normalize_name(full_name), exclude_id))
     else:
-        query = "SELECT COUNT(*) as cnt FROM members WHERE full_name = ?"
-        result = fetch_all(query, (full_name,))
+        query = """
+            SELECT COUNT(*) as cnt FROM members
+            WHERE full_name_norm = ? AND deleted_at IS NULL
+        """
+        result = fetch_all(query, (normalize_name(full_name),))
     return result[0][0] > 0 if result else False
 
 
+def move_members_to_group(member_ids, group_id):
+    """Move several members into a group with a single statement"""
+    member_ids = list(member_ids)
+    if not member_ids:
+        return True, "اعضا با موفقیت منتقل شدند"
+    placeholders = ", ".join("?" * len(member_ids))
+    query = f"""
+        UPDATE members SET group_id = ?
+        WHERE id IN ({placeholders}) AND deleted_at IS NULL
+          AND EXISTS (SELECT 1 FROM groups WHERE id = ? AND deleted_at IS NULL)
+        RETURNING id
+    """
+    try:
+        if not execute_returning(query, (group_id, *member_ids, group_id)):
+            if not _group_is_live(group_id):
+                return False, "گروه انتخاب شده وجود ندارد!"
+            return False, "عضو یافت نشد"
+        return True, "اعضا با موفقیت منتقل شدند"
+    except Exception as e:
+        return False, str(e)
+
+
 def toggle_member_active(member_id, is_active):
     """Toggle member active status"""
-    query = "UPDATE members SET is_active = ? WHERE id = ?"
+    query = """
+        UPDATE members SET is_active = ?
+        WHERE id = ? AND deleted_at IS NULL
+        RETURNING id
+    """
     try:
-        execute(query, (is_active, member_id))
+        if not execute_returning(query, (is_active, member_id)):
+            return False, "عضو یافت نشد"
         return True, "وضعیت عضو با موفقیت بروز شد"
     except Exception as e:
         return False, str(e)
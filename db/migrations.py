@@ -0,0 +1,655 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned schema migrations keyed on PRAGMA user_version
+
+Each Migration is applied in its own transaction together with the
+user_version bump, so a failed migration leaves the database at the
+previous version. migrate() is safe to run on every start: it only
+applies the migrations newer than the stored version.
+
+Migrations that rebuild a table (RebuildTable) are marked
+foreign_keys=False: they run with foreign key enforcement off, as the
+SQLite ALTER TABLE procedure requires (dropping the old table would
+otherwise cascade into its children), and PRAGMA foreign_key_check must
+come back empty before they commit.
+
+Index builds hold SQLite's write lock for as long as they take, so the
+app runs migrate() on a worker thread (see main.py); in WAL mode readers
+keep working meanwhile and the UI stays responsive.
+"""
+
+import logging
+import time
+from collections import namedtuple
+
+from db import fetch_all, transaction, writer
+from utils.date_utils import day_start_epoch, persian_date_to_day, persian_datetime_to_epoch
+from utils.text_utils import fold_phone_digits_sql, normalize_name_sql, normalize_phone_sql
+
+logger = logging.getLogger(__name__)
+
+# renames: the Rename records of a DisambiguateNames step, to show the user
+StepReport = namedtuple("StepReport", ["version", "migration", "step", "seconds", "renames"],
+                        defaults=((),))
+Rename = namedtuple("Rename", ["table", "row_id", "old_name", "new_name"])
+
+
+class CreateIndex:
+    """Migration step building an index with a larger sort cache"""
+
+    def __init__(self, name, table, columns, unique=False, where=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.where = where
+
+    def __str__(self):
+        return f"CREATE INDEX {self.name}"
+
+    def run(self, conn):
+        unique = "UNIQUE " if self.unique else ""
+        where = f" WHERE {self.where}" if self.where else ""
+        # Sort in memory with a bigger cache: the build (and the write lock
+        # it holds) finishes sooner on large tables.
+        cache_size = conn.execute("PRAGMA cache_size;").fetchone()[0]
+        conn.execute("PRAGMA cache_size = -65536;")
+        try:
+            conn.execute(f"CREATE {unique}INDEX IF NOT EXISTS {self.name} "
+                         f"ON {self.table}({self.columns}){where};")
+        finally:
+            conn.execute(f"PRAGMA cache_size = {cache_size};")
+
+
+class RebuildTable:
+    """Migration step recreating a table with a new definition, keeping its rows.
+
+    `columns` are copied from the old table; columns new in `create` get
+    their defaults. The table's indexes are dropped with it, so the
+    migration has to create them again. The AUTOINCREMENT counter is kept,
+    so ids of rows deleted earlier are still never reused.
+    """
+
+    def __init__(self, table, create, columns):
+        self.table = table
+        self.create = create
+        self.columns = columns
+
+    def __str__(self):
+        return f"REBUILD TABLE {self.table}"
+
+    def run(self, conn):
+        new = f"{self.table}_new"
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;",
+                           (self.table,)).fetchone()
+        conn.execute(self.create.format(table=new))
+        conn.execute(f"INSERT INTO {new} ({self.columns}) "
+                     f"SELECT {self.columns} FROM {self.table};")
+        conn.execute(f"DROP TABLE {self.table};")
+        conn.execute(f"ALTER TABLE {new} RENAME TO {self.table};")
+        if seq:
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = ?;", (self.table,))
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?);",
+                         (self.table, seq[0]))
+
+
+class DisambiguateNames:
+    """Migration step resolving names that collide under a new unique key.
+
+    Of the rows (not deleted) sharing a key the oldest keeps its name and
+    the others get " (<id>)" appended, so the unique index can be built.
+    run() returns the renames (see renamed_rows()) so they can be shown.
+    """
+
+    def __init__(self, table, column, key):
+        self.table = table
+        self.column = column
+        self.key = key
+
+    def __str__(self):
+        return f"DISAMBIGUATE {self.table}.{self.column}"
+
+    def run(self, conn):
+        rows = conn.execute(f"""
+            SELECT id, {self.column}, {self.key} FROM {self.table}
+            WHERE deleted_at IS NULL AND {self.key} IN (
+              SELECT {self.key} FROM {self.table}
+              WHERE deleted_at IS NULL
+              GROUP BY {self.key} HAVING COUNT(*) > 1)
+            ORDER BY id
+        """).fetchall()
+        seen = set()
+        renames = []
+        for row_id, name, key in rows:
+            if key not in seen:
+                seen.add(key)
+                continue
+            renamed = f"{name} ({row_id})"
+            conn.execute(f"UPDATE {self.table} SET {self.column} = ? WHERE id = ?;",
+                         (renamed, row_id))
+            logger.warning("%s %d renamed %r -> %r: same normalized name as an older row",
+                           self.table, row_id, name, renamed)
+            renames.append(Rename(self.table, row_id, name, renamed))
+        return renames
+
+
+class Backfill:
+    """Migration step filling a new column from another one with a Python function.
+
+    Only rows where the column is still NULL are touched; rows whose source
+    `convert` cannot read (it returns None) stay NULL and are logged.
+    """
+
+    def __init__(self, table, column, source, convert):
+        self.table = table
+        self.column = column
+        self.source = source
+        self.convert = convert
+
+    def __str__(self):
+        return f"BACKFILL {self.table}.{self.column}"
+
+    def run(self, conn):
+        rows = conn.execute(f"""
+            SELECT id, {self.source} FROM {self.table}
+            WHERE {self.column} IS NULL AND {self.source} IS NOT NULL
+        """).fetchall()
+        values = [(self.convert(source), row_id) for row_id, source in rows]
+        conn.executemany(f"UPDATE {self.table} SET {self.column} = ? WHERE id = ?;",
+                         [value for value in values if value[0] is not None])
+        unreadable = [row_id for value, row_id in values if value is None]
+        if unreadable:
+            logger.warning("%s.%s left NULL for %d rows with an unreadable %s (ids %s...)",
+                           self.table, self.column, len(unreadable), self.source,
+                           unreadable[:10])
+
+
+class Migration:
+    """One schema version: a list of SQL statements and/or step objects"""
+
+    def __init__(self, version, name, steps, foreign_keys=True):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        # False: run with foreign key enforcement off (table rebuilds)
+        self.foreign_keys = foreign_keys
+
+
+MIGRATIONS = [
+    Migration(1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS groups (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL UNIQUE,
+          leader_member_id INTEGER,
+          created_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS members (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          group_id INTEGER NOT NULL,
+          full_name TEXT NOT NULL,
+          phone TEXT,
+          is_active INTEGER NOT NULL DEFAULT 1,
+          joined_at TEXT NOT NULL,
+          UNIQUE(full_name),
+          FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+        )
+        """,
+        CreateIndex("idx_members_group_id", "members", "group_id"),
+    ]),
+    Migration(2, "indexes for is_active filters and per-group name order", [
+        # idx_members_group_id stays: it keeps per-group keyset pages in
+        # id order without a sort.
+        CreateIndex("idx_members_group_full_name", "members", "group_id, full_name"),
+        CreateIndex("idx_members_is_active", "members", "is_active"),
+    ]),
+    Migration(3, "soft delete: deleted_at and partial unique names", [
+        # UNIQUE is now only enforced among rows that are not deleted, so a
+        # deleted group's name can be reused before the purger removes it.
+        RebuildTable("groups", """
+            CREATE TABLE {table} (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              name TEXT NOT NULL,
+              leader_member_id INTEGER,
+              created_at TEXT NOT NULL,
+              deleted_at TEXT
+            )
+            """, "id, name, leader_member_id, created_at"),
+        RebuildTable("members", """
+            CREATE TABLE {table} (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              group_id INTEGER NOT NULL,
+              full_name TEXT NOT NULL,
+              phone TEXT,
+              is_active INTEGER NOT NULL DEFAULT 1,
+              joined_at TEXT NOT NULL,
+              deleted_at TEXT,
+              FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """, "id, group_id, full_name, phone, is_active, joined_at"),
+        CreateIndex("ux_groups_name", "groups", "name", unique=True,
+                    where="deleted_at IS NULL"),
+        CreateIndex("ux_members_full_name", "members", "full_name", unique=True,
+                    where="deleted_at IS NULL"),
+        CreateIndex("idx_members_group_id", "members", "group_id"),
+        CreateIndex("idx_members_group_full_name", "members", "group_id, full_name"),
+        CreateIndex("idx_members_is_active", "members", "is_active"),
+        # Small: only holds rows waiting for the purger
+        CreateIndex("idx_groups_deleted", "groups", "deleted_at",
+                    where="deleted_at IS NOT NULL"),
+        CreateIndex("idx_members_deleted", "members", "deleted_at",
+                    where="deleted_at IS NOT NULL"),
+    ], foreign_keys=False),
+    Migration(4, "Persian-normalized name keys", [
+        # Stored generated columns: SQLite keeps them current on every
+        # write, from any client, with built-in functions only.
+        RebuildTable("groups", f"""
+            CREATE TABLE {{table}} (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              name TEXT NOT NULL,
+              leader_member_id INTEGER,
+              created_at TEXT NOT NULL,
+              deleted_at TEXT,
+              name_norm TEXT GENERATED ALWAYS AS ({normalize_name_sql("name")}) STORED
+            )
+            """, "id, name, leader_member_id, created_at, deleted_at"),
+        RebuildTable("members", f"""
+            CREATE TABLE {{table}} (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              group_id INTEGER NOT NULL,
+              full_name TEXT NOT NULL,
+              phone TEXT,
+              is_active INTEGER NOT NULL DEFAULT 1,
+              joined_at TEXT NOT NULL,
+              deleted_at TEXT,
+              full_name_norm TEXT GENERATED ALWAYS AS ({normalize_name_sql("full_name")}) STORED,
+              FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """, "id, group_id, full_name, phone, is_active, joined_at, deleted_at"),
+        DisambiguateNames("groups", "name", "name_norm"),
+        DisambiguateNames("members", "full_name", "full_name_norm"),
+        CreateIndex("ux_groups_name_norm", "groups", "name_norm", unique=True,
+                    where="deleted_at IS NULL"),
+        CreateIndex("ux_members_full_name_norm", "members", "full_name_norm", unique=True,
+                    where="deleted_at IS NULL"),
+        # No longer unique by itself; kept for name-ordered member lists
+        CreateIndex("idx_members_full_name", "members", "full_name",
+                    where="deleted_at IS NULL"),
+        CreateIndex("idx_members_group_id", "members", "group_id"),
+        CreateIndex("idx_members_group_full_name", "members", "group_id, full_name"),
+        CreateIndex("idx_members_is_active", "members", "is_active"),
+        CreateIndex("idx_groups_deleted", "groups", "deleted_at",
+                    where="deleted_at IS NOT NULL"),
+        CreateIndex("idx_members_deleted", "members", "deleted_at",
+                    where="deleted_at IS NOT NULL"),
+    ], foreign_keys=False),
+    Migration(5, "PERSIAN-collated name indexes", [
+        # Needs the PERSIAN collation, which db.register_extensions() adds
+        # to every connection the db layer opens.
+        "DROP INDEX IF EXISTS idx_members_full_name",
+        "DROP INDEX IF EXISTS idx_members_group_full_name",
+        CreateIndex("idx_members_full_name_fa", "members", "full_name COLLATE PERSIAN",
+                    where="deleted_at IS NULL"),
+        CreateIndex("idx_members_group_full_name_fa", "members",
+                    "group_id, full_name COLLATE PERSIAN", where="deleted_at IS NULL"),
+        CreateIndex("idx_groups_name_fa", "groups", "name COLLATE PERSIAN",
+                    where="deleted_at IS NULL"),
+    ]),
+    Migration(6, "full-text member search", [
+        # Rowid = member id. The indexed text is already folded by the
+        # fa_normalize() SQL function (utils.text_utils.normalize_search,
+        # added by db.register_extensions), which the triggers below need
+        # on any connection that writes members or group names. Deleted
+        # members are not indexed.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+          full_name, phone, group_name,
+          tokenize = 'unicode61', prefix = '2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_insert
+        AFTER INSERT ON members WHEN new.deleted_at IS NULL
+        BEGIN
+          INSERT INTO members_fts(rowid, full_name, phone, group_name)
+          VALUES (new.id, fa_normalize(new.full_name), fa_normalize(new.phone),
+                  (SELECT fa_normalize(name) FROM groups WHERE id = new.group_id));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_update
+        AFTER UPDATE OF full_name, phone, group_id, deleted_at ON members
+        BEGIN
+          DELETE FROM members_fts WHERE rowid = old.id;
+          INSERT INTO members_fts(rowid, full_name, phone, group_name)
+          SELECT new.id, fa_normalize(new.full_name), fa_normalize(new.phone),
+                 (SELECT fa_normalize(name) FROM groups WHERE id = new.group_id)
+          WHERE new.deleted_at IS NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_delete
+        AFTER DELETE ON members
+        BEGIN
+          DELETE FROM members_fts WHERE rowid = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_groups_fts_rename
+        AFTER UPDATE OF name ON groups
+        BEGIN
+          UPDATE members_fts SET group_name = fa_normalize(new.name)
+          WHERE rowid IN (SELECT id FROM members
+                          WHERE group_id = new.id AND deleted_at IS NULL);
+        END
+        """,
+        """
+        INSERT INTO members_fts(rowid, full_name, phone, group_name)
+        SELECT m.id, fa_normalize(m.full_name), fa_normalize(m.phone), fa_normalize(g.name)
+        FROM members m
+        LEFT JOIN groups g ON g.id = m.group_id
+        WHERE m.deleted_at IS NULL
+        """,
+        "INSERT INTO members_fts(members_fts) VALUES ('optimize')",
+    ]),
+    Migration(7, "name trigram index for duplicate detection", [
+        # Trigrams of " " || full_name_norm || " " (utils.text_utils.name_ngrams),
+        # rowid = member id. The key is already lower-cased like the Python
+        # side, so the tokenizer must not fold case again. detail='none':
+        # only "which rows hold this
+        # trigram" is ever asked. The vocab table gives each trigram's
+        # document count, so lookups can probe the rarest ones only.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS members_ngram USING fts5(
+          name_key, tokenize = 'trigram case_sensitive 1', detail = 'none', columnsize = 0
+        )
+        """,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS members_ngram_vocab USING fts5vocab(members_ngram, row)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_ngram_insert
+        AFTER INSERT ON members WHEN new.deleted_at IS NULL
+        BEGIN
+          INSERT INTO members_ngram(rowid, name_key)
+          VALUES (new.id, ' ' || new.full_name_norm || ' ');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_ngram_update
+        AFTER UPDATE OF full_name, deleted_at ON members
+        BEGIN
+          DELETE FROM members_ngram WHERE rowid = old.id;
+          INSERT INTO members_ngram(rowid, name_key)
+          SELECT new.id, ' ' || new.full_name_norm || ' '
+          WHERE new.deleted_at IS NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_members_ngram_delete
+        AFTER DELETE ON members
+        BEGIN
+          DELETE FROM members_ngram WHERE rowid = old.id;
+        END
+        """,
+        """
+        INSERT INTO members_ngram(rowid, name_key)
+        SELECT id, ' ' || full_name_norm || ' ' FROM members WHERE deleted_at IS NULL
+        """,
+        "INSERT INTO members_ngram(members_ngram) VALUES ('optimize')",
+    ]),
+    Migration(8, "normalized phone numbers", [
+        # utils.text_utils.normalize_phone in SQL. VIRTUAL generated
+        # columns can be added without rebuilding members (which would
+        # drop its triggers); building the index computes phone_norm for
+        # every existing row. Two columns because one expression would
+        # nest replace() too deeply for SQLite's parser.
+        f"""
+        ALTER TABLE members ADD COLUMN phone_folded TEXT
+          GENERATED ALWAYS AS ({fold_phone_digits_sql("phone")}) VIRTUAL
+        """,
+        f"""
+        ALTER TABLE members ADD COLUMN phone_norm TEXT
+          GENERATED ALWAYS AS ({normalize_phone_sql("phone_folded")}) VIRTUAL
+        """,
+        CreateIndex("idx_members_phone_norm", "members", "phone_norm",
+                    where="deleted_at IS NULL"),
+    ]),
+    Migration(9, "integer date columns", [
+        # Sortable, range-searchable twins of the Jalali display strings,
+        # written by add_group()/add_member(): Unix time for groups, a day
+        # number (days since 1970-01-01, Afghanistan date) for members.
+        "ALTER TABLE groups ADD COLUMN created_epoch INTEGER",
+        "ALTER TABLE members ADD COLUMN joined_day INTEGER",
+        Backfill("groups", "created_epoch", "created_at", persian_datetime_to_epoch),
+        Backfill("members", "joined_day", "joined_at", persian_date_to_day),
+        CreateIndex("idx_groups_created_epoch", "groups", "created_epoch",
+                    where="deleted_at IS NULL"),
+        CreateIndex("idx_members_joined_day", "members", "joined_day",
+                    where="deleted_at IS NULL"),
+    ]),
+    Migration(10, "Jalali month index for per-month member counts", [
+        # jalali_month_key() is a deterministic function added by
+        # db.register_extensions; "GROUP BY jalali_month_key(joined_day)"
+        # reads this index in order instead of sorting.
+        CreateIndex("idx_members_joined_month", "members", "jalali_month_key(joined_day)",
+                    where="deleted_at IS NULL"),
+    ]),
+    Migration(11, "membership history", [
+        # One row per stretch of time a member spent in a group, as Unix
+        # times [valid_from, valid_to); valid_to is NULL while it lasts.
+        # Kept by triggers, so every write API records joins, moves and
+        # deletes. Archiving is not leaving the group: the row stays open
+        # and restore_member() carries on with it. No foreign keys: the
+        # history outlives purged members and groups.
+        """
+        CREATE TABLE IF NOT EXISTS membership_history (
+          id INTEGER PRIMARY KEY,
+          member_id INTEGER NOT NULL,
+          group_id INTEGER NOT NULL,
+          valid_from INTEGER NOT NULL,
+          valid_to INTEGER,
+          CHECK (valid_to IS NULL OR valid_to >= valid_from)
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_membership_insert
+        AFTER INSERT ON members WHEN new.deleted_at IS NULL
+        BEGIN
+          INSERT INTO membership_history (member_id, group_id, valid_from)
+          SELECT new.id, new.group_id, CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE NOT EXISTS (SELECT 1 FROM membership_history
+                            WHERE member_id = new.id AND valid_to IS NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_membership_update
+        AFTER UPDATE OF group_id, deleted_at ON members
+        WHEN old.group_id IS NOT new.group_id
+          OR (old.deleted_at IS NULL) != (new.deleted_at IS NULL)
+        BEGIN
+          UPDATE membership_history SET valid_to = CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE member_id = old.id AND valid_to IS NULL;
+          INSERT INTO membership_history (member_id, group_id, valid_from)
+          SELECT new.id, new.group_id, CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE new.deleted_at IS NULL;
+        END
+        """,
+        # Also ends the memberships of the group's archived members
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_membership_group_delete
+        AFTER UPDATE OF deleted_at ON groups
+        WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL
+        BEGIN
+          UPDATE membership_history SET valid_to = CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE group_id = old.id AND valid_to IS NULL;
+        END
+        """,
+        # Current members, in their group since the day they joined
+        f"""
+        INSERT INTO membership_history (member_id, group_id, valid_from)
+        SELECT id, group_id, COALESCE(joined_day * 86400 + {day_start_epoch(0)}, 0)
+        FROM members
+        WHERE deleted_at IS NULL
+          AND id NOT IN (SELECT member_id FROM membership_history)
+        """,
+        # At most one open stretch per member
+        CreateIndex("ux_membership_open", "membership_history", "member_id", unique=True,
+                    where="valid_to IS NULL"),
+        # As-of rosters: a group's stretches that began by the date, with
+        # valid_to and member_id read from the index
+        CreateIndex("idx_membership_group_asof", "membership_history",
+                    "group_id, valid_from, valid_to, member_id"),
+        CreateIndex("idx_membership_member", "membership_history", "member_id, valid_from"),
+    ]),
+    Migration(12, "normalized phone in member search", [
+        # members_fts.phone holds phone_norm (normalize_phone) instead of
+        # fa_normalize(phone), so "0799123456" finds "0799 123 456" and
+        # "+93 799 123 456"; search_members() folds the query the same way
+        "DROP TRIGGER IF EXISTS trg_members_fts_insert",
+        "DROP TRIGGER IF EXISTS trg_members_fts_update",
+        """
+        CREATE TRIGGER trg_members_fts_insert
+        AFTER INSERT ON members WHEN new.deleted_at IS NULL
+        BEGIN
+          INSERT INTO members_fts(rowid, full_name, phone, group_name)
+          VALUES (new.id, fa_normalize(new.full_name), new.phone_norm,
+                  (SELECT fa_normalize(name) FROM groups WHERE id = new.group_id));
+        END
+        """,
+        """
+        CREATE TRIGGER trg_members_fts_update
+        AFTER UPDATE OF full_name, phone, group_id, deleted_at ON members
+        BEGIN
+          DELETE FROM members_fts WHERE rowid = old.id;
+          INSERT INTO members_fts(rowid, full_name, phone, group_name)
+          SELECT new.id, fa_normalize(new.full_name), new.phone_norm,
+                 (SELECT fa_normalize(name) FROM groups WHERE id = new.group_id)
+          WHERE new.deleted_at IS NULL;
+        END
+        """,
+        "DELETE FROM members_fts",
+        """
+        INSERT INTO members_fts(rowid, full_name, phone, group_name)
+        SELECT m.id, fa_normalize(m.full_name), m.phone_norm, fa_normalize(g.name)
+        FROM members m
+        LEFT JOIN groups g ON g.id = m.group_id
+        WHERE m.deleted_at IS NULL
+        """,
+        "INSERT INTO members_fts(members_fts) VALUES ('optimize')",
+    ]),
+    Migration(13, "member names in membership history", [
+        # The roster of a past date has to name members who were archived
+        # or purged since, so each stretch keeps the member's name (kept
+        # current while the stretch is open)
+        "ALTER TABLE membership_history ADD COLUMN full_name TEXT",
+        "DROP TRIGGER IF EXISTS trg_membership_insert",
+        "DROP TRIGGER IF EXISTS trg_membership_update",
+        """
+        CREATE TRIGGER trg_membership_insert
+        AFTER INSERT ON members WHEN new.deleted_at IS NULL
+        BEGIN
+          INSERT INTO membership_history (member_id, group_id, full_name, valid_from)
+          SELECT new.id, new.group_id, new.full_name, CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE NOT EXISTS (SELECT 1 FROM membership_history
+                            WHERE member_id = new.id AND valid_to IS NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_membership_update
+        AFTER UPDATE OF group_id, deleted_at ON members
+        WHEN old.group_id IS NOT new.group_id
+          OR (old.deleted_at IS NULL) != (new.deleted_at IS NULL)
+        BEGIN
+          UPDATE membership_history SET valid_to = CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE member_id = old.id AND valid_to IS NULL;
+          INSERT INTO membership_history (member_id, group_id, full_name, valid_from)
+          SELECT new.id, new.group_id, new.full_name, CAST(strftime('%s', 'now') AS INTEGER)
+          WHERE new.deleted_at IS NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_membership_rename
+        AFTER UPDATE OF full_name ON members
+        WHEN old.full_name IS NOT new.full_name
+        BEGIN
+          UPDATE membership_history SET full_name = new.full_name
+          WHERE member_id = new.id AND valid_to IS NULL;
+        END
+        """,
+        """
+        UPDATE membership_history
+        SET full_name = (SELECT full_name FROM members WHERE id = membership_history.member_id)
+        WHERE full_name IS NULL
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version():
+    return fetch_all("PRAGMA user_version;")[0][0]
+
+
+def pending_migrations(migrations=MIGRATIONS):
+    version = current_version()
+    return [m for m in migrations if m.version > version]
+
+
+def renamed_rows(reports):
+    """Every Rename in a list of StepReports: names migrate() changed to keep them unique"""
+    return [rename for report in reports for rename in report.renames]
+
+
+def migrate(migrations=MIGRATIONS, progress=None):
+    """Apply pending migrations in order and return a StepReport per step.
+
+    `progress`, if given, is called as progress(migration, step_index,
+    step_count) before each step.
+    """
+    reports = []
+    for migration in pending_migrations(migrations):
+        started = time.perf_counter()
+        if migration.foreign_keys:
+            _apply(migration, reports, progress)
+        else:
+            # foreign_keys cannot change inside a transaction; hold the
+            # writer so nothing else writes while enforcement is off.
+            with writer() as conn:
+                conn.execute("PRAGMA foreign_keys = OFF;")
+                try:
+                    _apply(migration, reports, progress)
+                finally:
+                    conn.execute("PRAGMA foreign_keys = ON;")
+        logger.info("migration %d (%s) applied in %.3f s", migration.version,
+                    migration.name, time.perf_counter() - started)
+    return reports
+
+
+def _apply(migration, reports, progress):
+    with transaction() as conn:
+        # Another process may have applied it while we waited for the lock
+        if conn.execute("PRAGMA user_version;").fetchone()[0] >= migration.version:
+            return
+        if not migration.foreign_keys:
+            # Older files may already hold orphans; only new ones are errors
+            violations_before = len(conn.execute("PRAGMA foreign_key_check;").fetchall())
+        for i, step in enumerate(migration.steps):
+            if progress:
+                progress(migration, i, len(migration.steps))
+            step_started = time.perf_counter()
+            renames = ()
+            if isinstance(step, str):
+                conn.execute(step)
+            else:
+                renames = tuple(step.run(conn) or ())
+            label = " ".join(str(step).split())[:60]
+            reports.append(StepReport(migration.version, migration.name, label,
+                                      time.perf_counter() - step_started, renames))
+        if not migration.foreign_keys:
+            violations = conn.execute("PRAGMA foreign_key_check;").fetchall()
+            if len(violations) > violations_before:
+                raise RuntimeError(f"migration {migration.version} broke foreign keys: "
+                                   f"{violations[:5]}")
+        conn.execute(f"PRAGMA user_version = {migration.version};")
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Background purge of soft-deleted groups and members
+
+delete_group/delete_member only set deleted_at, which the read APIs
+filter out, so the user sees the row disappear at once. The actual DELETE
+(and the ON DELETE CASCADE work behind it) happens here, `batch_size`
+rows per transaction with a short pause in between, so the write lock is
+never held for long and clerks' writes slip in between batches. Members
+go first; a group is purged once none of its members are left, so its
+cascade has nothing to do.
+"""
+
+import logging
+import threading
+import time
+
+from db import fetch_all, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_PAUSE = 0.05
+DEFAULT_INTERVAL = 60.0
+
+
+def _purge_batch(table, condition, batch_size):
+    # An empty commit still counts as a change: it would reset the idle
+    # timer of db.maintenance and drop the repository caches and snapshot
+    if not fetch_all(f"SELECT 1 FROM {table} WHERE {condition} LIMIT 1"):
+        return 0
+    with transaction() as conn:
+        cursor = conn.execute(f"""
+            DELETE FROM {table}
+            WHERE id IN (SELECT id FROM {table} WHERE {condition} LIMIT ?)
+        """, (batch_size,))
+        return cursor.rowcount
+
+
+def purge_deleted(batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE, stop_event=None):
+    """Delete soft-deleted rows in small committed batches; returns (members, groups)"""
+    counts = []
+    for table, condition in (
+            ("members", "deleted_at IS NOT NULL"),
+            ("groups", "deleted_at IS NOT NULL "
+                       "AND NOT EXISTS (SELECT 1 FROM members m WHERE m.group_id = groups.id)")):
+        purged = 0
+        while not (stop_event and stop_event.is_set()):
+            deleted = _purge_batch(table, condition, batch_size)
+            purged += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+        counts.append(purged)
+    members, groups = counts
+    if members or groups:
+        logger.info("purged %d members and %d groups", members, groups)
+    return members, groups
+
+
+class Purger(threading.Thread):
+    """Runs purge_deleted() every `interval` seconds, or right away when woken"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE,
+                 pause=DEFAULT_PAUSE):
+        super().__init__(name="db-purger", daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                return
+            try:
+                purge_deleted(self.batch_size, self.pause, self._stop_event)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                logger.warning("purge failed: %s", e)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        """Stop after the current batch; unpurged rows wait for the next start"""
+        self._stop_event.set()
+        self._wake.set()
+        self.join()
+
+
+_purger = None
+
+
+def start_purger(interval=DEFAULT_INTERVAL, **kwargs):
+    """Purge soft-deleted rows on a background thread"""
+    global _purger
+    if _purger is not None:
+        return
+    _purger = Purger(interval, **kwargs)
+    _purger.start()
+
+
+def wake_purger():
+    """Purge now instead of at the next interval (e.g. after a delete)"""
+    if _purger is not None:
+        _purger.wake()
+
+
+def stop_purger():
+    global _purger
+    if _purger is not None:
+        _purger.stop()
+        _purger = None
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Debounced, cancellable read queries off the GUI thread
+
+Requests are keyed (e.g. one key per filter box). A new request for a key
+replaces the pending one and restarts its debounce delay, so typing
+"abc" quickly runs one query, not three. If the query for that key is
+already running it is aborted with Connection.interrupt(). Every
+request's Future is either resolved with the newest result or cancelled
+once superseded, so callers only ever see the latest answer.
+
+Queries run on the executor thread, so they use that thread's read-only
+connection and never wait on the GUI thread or the writer. Interrupting
+covers that connection and the report snapshot (db.snapshot); queries on
+any other connection a request opens itself run to the end.
+"""
+
+import atexit
+import itertools
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from db import get_conn
+from db.snapshot import interrupt_snapshot_query
+
+DEFAULT_DELAY = 0.25
+
+
+class _Request:
+    __slots__ = ("key", "generation", "func", "args", "kwargs", "due", "future")
+
+    def __init__(self, key, generation, func, args, kwargs, due):
+        self.key = key
+        self.generation = generation
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.due = due
+        self.future = Future()
+
+
+class QueryExecutor:
+    """One worker thread running the newest request per key after a debounce delay"""
+
+    def __init__(self, delay=DEFAULT_DELAY):
+        self.delay = delay
+        self.interrupted = 0
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._latest = {}
+        self._generations = itertools.count(1)
+        self._running = None
+        self._conn = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="db-query-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, func, *args, delay=None, **kwargs):
+        """Run func(*args, **kwargs) for `key` after the debounce delay.
+
+        Returns a Future; it is cancelled if a newer request for the same key
+        arrives before this one's result is delivered.
+        """
+        delay = self.delay if delay is None else delay
+        with self._cond:
+            request = _Request(key, next(self._generations), func, args, kwargs,
+                               time.monotonic() + delay)
+            self._supersede(key)
+            self._latest[key] = request.generation
+            self._pending[key] = request
+            self._cond.notify()
+        return request.future
+
+    def cancel(self, key):
+        """Drop the pending and running request for `key`"""
+        with self._cond:
+            self._supersede(key)
+            self._latest.pop(key, None)
+
+    def _supersede(self, key):
+        old = self._pending.pop(key, None)
+        if old is not None:
+            old.future.cancel()
+        if self._running is not None and self._running.key == key:
+            self.interrupted += 1
+            self._interrupt()
+
+    def _interrupt(self):
+        """Abort the running query, on the reader or on the report snapshot"""
+        if self._conn is not None:
+            self._conn.interrupt()
+        interrupt_snapshot_query(self._thread.ident)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            for request in self._pending.values():
+                request.future.cancel()
+            self._pending.clear()
+            if self._running is not None:
+                self._interrupt()
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_request(self):
+        """Wait for the earliest due request and mark it running (None = stop)"""
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if self._pending:
+                    request = min(self._pending.values(), key=lambda r: r.due)
+                    wait = request.due - time.monotonic()
+                    if wait <= 0:
+                        del self._pending[request.key]
+                        if request.future.cancelled():
+                            # Cancelled by its caller while it waited
+                            continue
+                        self._running = request
+                        return request
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+            # The connection can change after use_database/close_all
+            self._conn = get_conn()
+            try:
+                result = request.func(*request.args, **request.kwargs)
+                error = None
+            except Exception as e:
+                result, error = None, e
+            with self._cond:
+                self._running = None
+                current = self._latest.get(request.key) == request.generation
+                if current:
+                    del self._latest[request.key]
+            interrupted = isinstance(error, sqlite3.OperationalError) and "interrupted" in str(error)
+            try:
+                if not current or interrupted:
+                    request.future.cancel()
+                elif error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(result)
+            except InvalidStateError:
+                pass  # the caller cancelled the future while the query ran
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_query_executor():
+    """The process-wide query executor, started on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = QueryExecutor()
+        return _executor
+
+
+def submit_query(key, func, *args, **kwargs):
+    """Debounced func(*args) on the executor thread; returns a Future"""
+    return get_query_executor().submit(key, func, *args, **kwargs)
+
+
+def stop_query_executor():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.stop()
+
+
+atexit.register(stop_query_executor)
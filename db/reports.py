@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Report queries
+
+Reports read the whole members table, so they run against the in-memory
+snapshot (db.snapshot) by default instead of holding a read transaction
+on the live database. Pass fetch=db.fetch_all to read the live data.
+"""
+
+from db.snapshot import get_snapshot
+
+
+def _fetch(fetch):
+    return fetch or get_snapshot().fetch_all
+
+
+def get_group_summary(fetch=None):
+    """Per group: id, name, member count, active member count (by name)"""
+    query = """
+        SELECT g.id, g.name,
+               COUNT(m.id) AS member_count,
+               COALESCE(SUM(m.is_active), 0) AS active_count
+        FROM groups g
+        LEFT JOIN members m ON m.group_id = g.id AND m.deleted_at IS NULL
+        WHERE g.deleted_at IS NULL
+        GROUP BY g.id
+        ORDER BY g.name COLLATE PERSIAN
+    """
+    return _fetch(fetch)(query)
+
+
+def get_member_totals(fetch=None):
+    """(all members, active members, groups) in one consistent read"""
+    query = """
+        SELECT (SELECT COUNT(*) FROM members WHERE deleted_at IS NULL),
+               (SELECT COUNT(*) FROM members WHERE is_active = 1 AND deleted_at IS NULL),
+               (SELECT COUNT(*) FROM groups WHERE deleted_at IS NULL)
+    """
+    return _fetch(fetch)(query)[0]
+
+
+def get_new_members_per_month(year=None, fetch=None):
+    """(Jalali month key, new members) per month, e.g. (140411, 37); one year or all"""
+    query = """
+        SELECT jalali_month_key(joined_day) AS month, COUNT(*)
+        FROM members
+        WHERE deleted_at IS NULL AND jalali_month_key(joined_day) IS NOT NULL
+    """
+    params = ()
+    if year is not None:
+        query += " AND jalali_month_key(joined_day) BETWEEN ? AND ?"
+        params = (year * 100 + 1, year * 100 + 12)
+    query += " GROUP BY jalali_month_key(joined_day) ORDER BY month"
+    return _fetch(fetch)(query, params)
+
+
+def get_new_groups_per_year(fetch=None):
+    """(Jalali year, groups created) per year"""
+    query = """
+        SELECT jalali_year(created_at) AS year, COUNT(*)
+        FROM groups
+        WHERE deleted_at IS NULL
+        GROUP BY year
+        ORDER BY year
+    """
+    return _fetch(fetch)(query)
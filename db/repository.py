@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Cached repositories over groups_db and members_db
+
+Each repository keeps an identity map (id -> row) plus the lists and
+keyset pages it has loaded, and serves them again without touching SQLite
+for as long as the database is unchanged. Before every read it compares
+db.get_change_token() (PRAGMA data_version + this process's commit
+counter) with the token the cache was filled under; any commit, from this
+process or another one, drops the whole cache. Checking costs one PRAGMA
+on the reader connection.
+
+Reads inside an open transaction bypass the cache so they see their own
+uncommitted changes.
+"""
+
+import threading
+
+from db import get_change_token, in_transaction, iter_pages
+from db import groups_db, members_db
+
+
+class Repository:
+    """Identity map and list cache invalidated by db.get_change_token()"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._token = None
+        self._rows = {}
+        self._lists = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _validate(self):
+        """Drop the cache if the database changed; False inside a transaction"""
+        if in_transaction():
+            return False
+        token = get_change_token()
+        if token != self._token:
+            self._rows.clear()
+            self._lists.clear()
+            self._token = token
+        return True
+
+    def _remember(self, rows):
+        """Put rows in the identity map and return the canonical instances"""
+        canonical = []
+        for row in rows:
+            canonical.append(self._rows.setdefault(row[0], row))
+        return canonical
+
+    def _get(self, row_id, loader):
+        with self._lock:
+            if not self._validate():
+                return loader(row_id)
+            row = self._rows.get(row_id)
+            if row is not None:
+                self.hits += 1
+                return row
+            self.misses += 1
+            row = loader(row_id)
+            if row is not None:
+                self._rows[row_id] = row
+            return row
+
+    def _list(self, key, loader, remember=True):
+        with self._lock:
+            if not self._validate():
+                return loader()
+            rows = self._lists.get(key)
+            if rows is not None:
+                self.hits += 1
+                return rows
+            self.misses += 1
+            rows = loader()
+            rows = tuple(self._remember(rows) if remember else rows)
+            self._lists[key] = rows
+            return rows
+
+    def _page(self, key, loader):
+        """A db.Page cached under `key`; its rows go through the identity map"""
+        with self._lock:
+            if not self._validate():
+                return loader()
+            page = self._lists.get(key)
+            if page is not None:
+                self.hits += 1
+                return page
+            self.misses += 1
+            page = loader()
+            page = page._replace(rows=tuple(self._remember(page.rows)))
+            self._lists[key] = page
+            return page
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._rows.clear()
+            self._lists.clear()
+
+
+class GroupRepository(Repository):
+    """Groups rows as returned by groups_db.get_all_groups/get_group_by_id"""
+
+    def page(self, page_size=200, cursor=None):
+        """One page of groups_db.get_groups_page, cached per cursor"""
+        return self._page(("page", page_size, cursor),
+                          lambda: groups_db.get_groups_page(page_size, cursor))
+
+    def iter_pages(self, page_size=200):
+        """Stream all groups, newest first, page by page from the cache"""
+        return iter_pages(self.page, page_size)
+
+    def get(self, group_id):
+        return self._get(group_id, groups_db.get_group_by_id)
+
+
+class MemberRepository(Repository):
+    """Member rows as returned by members_db.get_all_members/get_member_by_id"""
+
+    def page(self, page_size=200, cursor=None):
+        """One page of members_db.get_members_page, cached per cursor"""
+        return self._page(("page", page_size, cursor),
+                          lambda: members_db.get_members_page(page_size, cursor))
+
+    def iter_pages(self, page_size=200):
+        """Stream all members, newest first, page by page from the cache"""
+        return iter_pages(self.page, page_size)
+
+    def get(self, member_id):
+        return self._get(member_id, members_db.get_member_by_id)
+
+    def by_group(self, group_id):
+        # Different row shape from get(), so kept out of the identity map
+        return self._list(("group", group_id),
+                          lambda: members_db.get_members_by_group(group_id), remember=False)
+
+    def choices(self):
+        """(id, full_name) pairs ordered by name"""
+        return self._list("choices", members_db.get_member_choices, remember=False)
+
+
+group_repository = GroupRepository()
+member_repository = MemberRepository()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Consistent in-memory read snapshot for reports
+
+A long report query on fund.db keeps a read transaction open for its
+whole run, which stops checkpoints from finishing and competes with the
+clerks' writes. A Snapshot instead copies the live database into a
+private in-memory connection with the backup API (`pages_per_step` pages
+at a time, so the writer is never held up for long) and runs report
+queries against that copy: every query of a report sees the same state,
+and none of them touch fund.db.
+
+The copy is refreshed on demand (refresh()) and, with auto_refresh, before
+a query whenever the database changed since it was taken: PRAGMA
+data_version on a small monitor connection for commits from other
+connections and processes, and the commit counter for this process.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from db import connect, get_database, get_write_stats, register_extensions
+
+DEFAULT_PAGES_PER_STEP = 1024
+
+SnapshotInfo = namedtuple("SnapshotInfo", ["pages", "seconds", "taken_at"])
+
+
+class Snapshot:
+    """An in-memory copy of the database, refreshed when the source changes"""
+
+    def __init__(self, pages_per_step=DEFAULT_PAGES_PER_STEP, auto_refresh=True):
+        self.pages_per_step = pages_per_step
+        self.auto_refresh = auto_refresh
+        self.refreshes = 0
+        self.info = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._conn = None
+        self._running = None  # thread id of the query running on _conn
+        self._running_lock = threading.Lock()
+        self._token = None
+        self._monitor = None
+        self._monitor_target = None
+
+    def _current_token(self):
+        """(database, data_version, commits) as seen right now"""
+        with self._lock:
+            target = get_database()
+            if self._monitor is None or self._monitor_target != target:
+                if self._monitor is not None:
+                    self._monitor.close()
+                self._monitor = connect(read_only=True)
+                self._monitor_target = target
+            data_version = self._monitor.execute("PRAGMA data_version;").fetchone()[0]
+            return target, data_version, get_write_stats()["commits"]
+
+    def is_stale(self):
+        """True if there is no copy yet or the database changed since it was taken"""
+        return self._conn is None or self._current_token() != self._token
+
+    def refresh(self):
+        """Copy the database again; queries keep using the old copy meanwhile"""
+        with self._refresh_lock:
+            # Taken before the copy: a commit during the copy makes the new
+            # copy look stale, never the other way round.
+            token = self._current_token()
+            started = time.perf_counter()
+            pages = [0]
+
+            def on_step(status, remaining, total):
+                pages[0] = total
+
+            source = connect(read_only=True)
+            target = sqlite3.connect(":memory:", check_same_thread=False)
+            register_extensions(target)
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=on_step)
+            except sqlite3.Error:
+                target.close()
+                raise
+            finally:
+                source.close()
+            target.execute("PRAGMA query_only = ON;")
+
+            with self._lock:
+                old, self._conn = self._conn, target
+                self._token = token
+                self.refreshes += 1
+                self.info = SnapshotInfo(pages[0], time.perf_counter() - started, time.time())
+                if old is not None:
+                    old.close()
+            return self.info
+
+    def ensure_fresh(self):
+        """Take the first copy, or a new one if stale and auto_refresh is on"""
+        if self._conn is None or (self.auto_refresh and self.is_stale()):
+            self.refresh()
+
+    def fetch_all(self, query, params=()):
+        """db.fetch_all() against the snapshot"""
+        self.ensure_fresh()
+        with self._lock:
+            with self._running_lock:
+                self._running = threading.get_ident()
+            try:
+                return self._conn.execute(query, params).fetchall()
+            finally:
+                with self._running_lock:
+                    self._running = None
+
+    def interrupt(self, thread_id):
+        """Abort the query running on the snapshot if thread `thread_id` started it"""
+        with self._running_lock:
+            if self._running == thread_id and self._conn is not None:
+                self._conn.interrupt()
+                return True
+            return False
+
+    def close(self):
+        with self._refresh_lock, self._lock:
+            for conn in (self._conn, self._monitor):
+                if conn is not None:
+                    conn.close()
+            self._conn = self._monitor = None
+            self._token = self._monitor_target = None
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """The process-wide report snapshot, created on first use"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = Snapshot()
+        return _snapshot
+
+
+def interrupt_snapshot_query(thread_id):
+    """Snapshot.interrupt() on the process-wide snapshot, if there is one"""
+    snapshot = _snapshot
+    return snapshot is not None and snapshot.interrupt(thread_id)
+
+
+def close_snapshot():
+    global _snapshot
+    with _snapshot_lock:
+        snapshot, _snapshot = _snapshot, None
+    if snapshot is not None:
+        snapshot.close()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Single writer thread with write coalescing
+
+Write functions (add_group, toggle_member_active, ...) are submitted to a
+queue and run on one background thread, so a busy or locked database
+never blocks the GUI thread. Jobs that arrive together are coalesced:
+the thread drains whatever is queued (waiting at most `linger` seconds
+for stragglers) and runs the whole batch in a single transaction, each
+job inside its own savepoint so one failure does not undo the others.
+
+submit() returns a concurrent.futures.Future resolved after the batch has
+committed, with the same (success, message) result the function returns;
+an exception becomes (False, str(exc)). ui.future_watcher turns the
+future into a Qt signal delivered on the GUI thread.
+"""
+
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+
+from db import transaction
+
+_STOP = object()
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "future")
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class _JobFailed(Exception):
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+class WriteQueue:
+    """Runs submitted write functions on one thread, batching bursts"""
+
+    def __init__(self, max_batch=500, linger=0.005):
+        self.max_batch = max_batch
+        self.linger = linger
+        self.batches = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs); returns a Future of its (success, message)"""
+        job = _Job(func, args, kwargs)
+        job.future.set_running_or_notify_cancel()
+        self._queue.put(job)
+        return job.future
+
+    def stop(self):
+        """Finish the queued jobs, then stop the thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        stop = False
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=self.linger)
+            except queue.Empty:
+                break
+            if job is _STOP:
+                stop = True
+                break
+            batch.append(job)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            batch, stop = self._collect(job)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        results = []
+        try:
+            with transaction():
+                for job in batch:
+                    results.append(self._run_job(job))
+        except Exception as e:
+            # The commit itself failed: nothing in the batch was written
+            for job in batch:
+                job.future.set_result((False, str(e)))
+            return
+        self.batches += 1
+        self.jobs += len(batch)
+        for job, result in zip(batch, results):
+            job.future.set_result(result)
+
+    def _run_job(self, job):
+        try:
+            with transaction():
+                result = job.func(*job.args, **job.kwargs)
+                if isinstance(result, tuple) and len(result) == 2 and result[0] is False:
+                    # Roll back whatever the job did before reporting failure
+                    raise _JobFailed(result)
+                return result
+        except _JobFailed as e:
+            return e.result
+        except Exception as e:
+            return False, str(e)
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """The process-wide write queue, started on first use"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue()
+        return _write_queue
+
+
+def submit_write(func, *args, **kwargs):
+    """Run a write function on the writer thread; returns a Future"""
+    return get_write_queue().submit(func, *args, **kwargs)
+
+
+def stop_write_queue():
+    """Drain and stop the writer thread (a later submit starts a new one)"""
+    global _write_queue
+    with _write_queue_lock:
+        write_queue, _write_queue = _write_queue, None
+    if write_queue is not None:
+        write_queue.stop()
+
+
+atexit.register(stop_write_queue)
@@ -1,16 +1,30 @@
+import argparse
+import logging
+import os
 import sys
+import threading
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget,
                              QVBoxLayout, QHBoxLayout, QStackedWidget,
                              QListWidget, QToolButton, QLabel,
-                             QAction, QMessageBox)
+                             QAction, QMessageBox, QProgressDialog)
 
 from ui.tabs.groups_tab import GroupsTab
 from ui.tabs.members_tab import MembersTab
 
 from ui.styles import LIGHT_STYLE, DARK_STYLE
+from db import close_all, start_checkpointer, use_database, add_database_argument
+from db.migrations import migrate, pending_migrations, renamed_rows
+from db.query_executor import stop_query_executor
+from db.writer import stop_write_queue
+from db.backup import backup_in_background, start_backup_schedule, stop_backup_schedule
+from db.maintenance import start_maintenance_schedule, shutdown_maintenance
+from db.snapshot import close_snapshot
+from db.purger import start_purger, stop_purger
+from ui.future_watcher import FutureWatcher
 
+logger = logging.getLogger(__name__)
 
 
 class MainWindow(QMainWindow):
@@ -25,6 +39,12 @@ class MainWindow(QMainWindow):
         file_menu = menubar.addMenu("پرونده")
         help_menu = menubar.addMenu("راهنما")
 
+        act_backup = QAction("پشتیبان‌گیری", self)
+        act_backup.triggered.connect(self.backup_database)
+        file_menu.addAction(act_backup)
+        self.act_backup = act_backup
+        file_menu.addSeparator()
+
         act_exit = QAction("خروج", self)
         act_exit.triggered.connect(self.close)
         file_menu.addAction(act_exit)
@@ -179,6 +199,27 @@ class MainWindow(QMainWindow):
             "برنامه مدیریت صندوق\nPyQt5 + SQLite\n(صندوق تعاونی)"
         )
 
+    def backup_database(self):
+        """Take an online backup on a background thread"""
+        self.act_backup.setEnabled(False)
+        self.statusBar().showMessage("در حال پشتیبان‌گیری...")
+        FutureWatcher(backup_in_background(), self,
+                      on_finished=self.on_backup_finished, on_failed=self.on_backup_failed)
+
+    def on_backup_finished(self, result):
+        self.act_backup.setEnabled(True)
+        self.statusBar().clearMessage()
+        QMessageBox.information(
+            self,
+            "پشتیبان‌گیری",
+            f"پشتیبان با موفقیت ذخیره و بررسی شد:\n{result.path}"
+        )
+
+    def on_backup_failed(self, error):
+        self.act_backup.setEnabled(True)
+        self.statusBar().clearMessage()
+        QMessageBox.critical(self, "خطا", f"پشتیبان‌گیری ناموفق بود:\n{error}")
+
     def refresh_all(self):
         """Later we call this after any insert/update so all tabs can reload data."""
         for w in [
@@ -189,10 +230,86 @@ class MainWindow(QMainWindow):
                 w.refresh()
 
 
+def run_migrations(app):
+    """Bring the database schema up to date before the main window is built.
+
+    Migrations run on a worker thread while a progress dialog keeps the
+    event loop going, so building indexes on a large database does not
+    freeze the window.
+    """
+    if not pending_migrations():
+        return True
+
+    dialog = QProgressDialog("در حال بروزرسانی پایگاه داده...", None, 0, 0)
+    dialog.setWindowTitle("بروزرسانی")
+    dialog.setWindowModality(Qt.ApplicationModal)
+    dialog.setMinimumDuration(0)
+    dialog.show()
+
+    result = {}
+
+    def work():
+        try:
+            result["reports"] = migrate()
+        except Exception as e:
+            result["error"] = e
+
+    worker = threading.Thread(target=work, name="migrations")
+    worker.start()
+    while worker.is_alive():
+        app.processEvents()
+        worker.join(0.05)
+    dialog.close()
+
+    if "error" in result:
+        QMessageBox.critical(None, "خطا", f"بروزرسانی پایگاه داده ناموفق بود:\n{result['error']}")
+        return False
+    for report in result["reports"]:
+        logger.info("migration v%d %s: %.1f ms", report.version, report.step,
+                    report.seconds * 1000)
+    renames = renamed_rows(result["reports"])
+    if renames:
+        tables = {"groups": "گروه", "members": "عضو"}
+        lines = [f"{tables.get(r.table, r.table)} {r.row_id}: {r.old_name} ← {r.new_name}"
+                 for r in renames[:20]]
+        if len(renames) > 20:
+            lines.append(f"... و {len(renames) - 20} مورد دیگر (جزئیات در گزارش برنامه)")
+        QMessageBox.warning(
+            None, "نام‌های تکراری",
+            "این نام‌ها با نام دیگری یکسان بودند و تغییر کردند؛ در صورت نیاز آن‌ها را "
+            "دستی ادغام یا اصلاح کنید:\n\n" + "\n".join(lines))
+    return True
+
+
 def main():
-    app = QApplication(sys.argv)
+    # --db is ours; everything else is left for Qt
+    parser = add_database_argument(argparse.ArgumentParser(description="صندوق تعاونی"))
+    args, qt_args = parser.parse_known_args(sys.argv[1:])
+    if args.db:
+        use_database(args.db)
+
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setLayoutDirection(Qt.RightToLeft)
     app.setFont(QFont("Tahoma", 10))
+    if not run_migrations(app):
+        sys.exit(1)
+    start_checkpointer()
+    start_backup_schedule()
+    # ANALYZE / incremental vacuum only when idle and on exit, never here
+    start_maintenance_schedule()
+    start_purger()
+    if os.environ.get("SANDOQ_SLOW_QUERY_MS"):
+        # Opt-in query stats and slow-query log for support tickets
+        from db.instrumentation import enable_instrumentation
+        enable_instrumentation(float(os.environ["SANDOQ_SLOW_QUERY_MS"]))
+    # Drain queued writes before the connections are closed
+    app.aboutToQuit.connect(stop_backup_schedule)
+    app.aboutToQuit.connect(stop_query_executor)
+    app.aboutToQuit.connect(stop_write_queue)
+    app.aboutToQuit.connect(stop_purger)
+    app.aboutToQuit.connect(close_snapshot)
+    app.aboutToQuit.connect(shutdown_maintenance)
+    app.aboutToQuit.connect(close_all)
     win = MainWindow()
     # set default theme to light
     win.apply_theme('light')
@@ -7,7 +7,9 @@ from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                              QLineEdit, QPushButton, QMessageBox, QComboBox,
                              QFrame, QGroupBox)
-from db.groups_db import group_exists, get_group_by_id
+from db.repository import group_repository, member_repository
+from db.writer import submit_write
+from ui.future_watcher import FutureWatcher
 
 
 class GroupDialog(QDialog):
@@ -198,8 +200,7 @@ class GroupDialog(QDialog):
         layout.addWidget(self.combo_leader)
         
         # populate leaders from members table
-        from db import fetch_all
-        members = fetch_all("SELECT id, full_name FROM members ORDER BY full_name")
+        members = member_repository.choices()
         for m in members:
             self.combo_leader.addItem(m[1], m[0])
         
@@ -211,6 +212,7 @@ class GroupDialog(QDialog):
         btn_save.setMinimumHeight(40)
         btn_save.setMinimumWidth(120)
         btn_save.clicked.connect(self.save_group)
+        self.btn_save = btn_save
         btn_save.setStyleSheet("""
             QPushButton {
                 background-color: #2563eb;
@@ -252,7 +254,7 @@ class GroupDialog(QDialog):
         """Load group data for editing or viewing"""
         from utils.date_utils import format_datetime_to_persian
         
-        group = get_group_by_id(self.group_id)
+        group = group_repository.get(self.group_id)
         if group:
             gid, name, leader_id, leader_name, created = group
             
@@ -281,25 +283,26 @@ class GroupDialog(QDialog):
             QMessageBox.warning(self, "خطا", "نام گروه نمی‌تواند خالی باشد!")
             return
         
-        # Check for duplicates
-        if not self.group_id and group_exists(name):
-            QMessageBox.warning(self, "خطا", "گروهی با این نام قبلاً وجود دارد!")
-            return
-        
-        if self.group_id and group_exists(name, self.group_id):
-            QMessageBox.warning(self, "خطا", "گروهی دیگر با این نام وجود دارد!")
-            return
-        
         leader_id = self.combo_leader.currentData()
         
         # Import here to avoid circular imports
         from db.groups_db import add_group, update_group
         
+        # Save on the writer thread; the dialog stays responsive meanwhile.
+        # A duplicate name is rejected by the unique index and comes back as
+        # the failure message, so there is no separate check that could race.
+        self.btn_save.setEnabled(False)
         if self.group_id:
-            success, msg = update_group(self.group_id, name, leader_id)
+            future = submit_write(update_group, self.group_id, name, leader_id)
         else:
-            success, msg = add_group(name, leader_id)
-        
+            future = submit_write(add_group, name, leader_id)
+        FutureWatcher(future, self,
+                      on_finished=lambda result: self.on_save_finished(*result),
+                      on_failed=lambda error: self.on_save_finished(False, str(error)))
+    
+    def on_save_finished(self, success, msg):
+        """Called on the GUI thread when the background save has finished"""
+        self.btn_save.setEnabled(True)
         if success:
             QMessageBox.information(self, "موفق", 
                 "گروه جدید با موفقیت ایجاد شد!" if not self.group_id 
@@ -307,4 +310,4 @@ class GroupDialog(QDialog):
             self.group_saved.emit()
             self.accept()
         else:
-            QMessageBox.critical(self, "خطا", f"خطا: {msg}")
+            QMessageBox.warning(self, "خطا", msg)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Deliver the result of a background Future to the GUI thread as a Qt signal
+"""
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class FutureWatcher(QObject):
+    """Emits `finished(result)` or `failed(exception)` on the GUI thread.
+
+    The future's done-callback runs on the worker thread; emitting a signal
+    of an object that lives on the GUI thread from there is delivered as a
+    queued call, so connected slots can touch widgets safely. A cancelled
+    future (e.g. a superseded query) emits nothing.
+
+    Pass the slots as `on_finished`/`on_failed`: they are connected before
+    the done-callback is attached, which runs it at once if the future has
+    already finished.
+    """
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    def __init__(self, future, parent=None, on_finished=None, on_failed=None):
+        super().__init__(parent)
+        if on_finished is not None:
+            self.finished.connect(on_finished)
+        if on_failed is not None:
+            self.failed.connect(on_failed)
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        if not future.cancelled():
+            error = future.exception()
+            if error is None:
+                self.finished.emit(future.result())
+            else:
+                self.failed.emit(error)
+        self.deleteLater()
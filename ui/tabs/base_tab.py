@@ -7,6 +7,10 @@ Provides consistent styling and structure for all tabs
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout
 
+from db.query_executor import submit_query
+from db.writer import submit_write
+from ui.future_watcher import FutureWatcher
+
 
 class BaseTab(QWidget):
     """Base class for all tab widgets with common functionality"""
@@ -49,6 +53,31 @@ class BaseTab(QWidget):
         """Override this method in subclasses to refresh data"""
         pass
     
+    def run_write(self, callback, func, *args, **kwargs):
+        """Run a db write function on the writer thread.
+
+        callback(success, message) is called on the GUI thread once the
+        write has committed.
+        """
+        return FutureWatcher(submit_write(func, *args, **kwargs), self,
+                             on_finished=lambda result: callback(*result))
+    
+    def run_query(self, key, callback, func, *args, delay=None, **kwargs):
+        """Run a db read function off the GUI thread, debounced per key.
+
+        Meant for filter boxes: call it on every keystroke. Older requests
+        for the same key are dropped (or interrupted if already running),
+        and callback(result) is only called, on the GUI thread, with the
+        newest result.
+        """
+        future = submit_query((id(self), key), func, *args, delay=delay, **kwargs)
+        return FutureWatcher(future, self, on_finished=callback,
+                             on_failed=self.on_query_failed)
+    
+    def on_query_failed(self, error):
+        """Override to report failed background queries"""
+        pass
+    
     def create_button(self, text, callback=None, style="primary"):
         """Create a styled button for the tab"""
         btn = QPushButton(text)
@@ -6,7 +6,8 @@ from PyQt5.QtWidgets import (QWidget, QHBoxLayout, QPushButton, QToolButton,
 from PyQt5.QtGui import QColor
 from PyQt5.QtWidgets import QSizePolicy
 from .base_tab import BaseTab
-from db.groups_db import get_all_groups, delete_group
+from db.groups_db import delete_group
+from db.repository import group_repository
 from ui.dialogs.group_dialog import GroupDialog
 
 
@@ -291,7 +292,9 @@ class GroupsTab(BaseTab):
     def refresh(self):
         """Refresh groups table with beautiful styling"""
         self.table.setRowCount(0)
-        groups = get_all_groups()
+        # Stream the table page by page; pages come from the repository
+        # cache while the database is unchanged
+        groups = (group for page in group_repository.iter_pages() for group in page.rows)
         
         from utils.date_utils import format_datetime_to_persian
         for idx, group in enumerate(groups):
@@ -398,12 +401,15 @@ class GroupsTab(BaseTab):
             no_btn.setText("خیر")
         reply = msg.exec_()
         if reply == QMessageBox.Yes:
-            success, msg_text = delete_group(group_id)
-            if success:
-                QMessageBox.information(self, "موفق", msg_text)
-                self.on_group_saved()
-            else:
-                QMessageBox.critical(self, "خطا", f"خطا: {msg_text}")
+            self.run_write(self.on_group_deleted, delete_group, group_id)
+
+    def on_group_deleted(self, success, msg_text):
+        """Called on the GUI thread when the background delete has finished"""
+        if success:
+            QMessageBox.information(self, "موفق", msg_text)
+            self.on_group_saved()
+        else:
+            QMessageBox.critical(self, "خطا", f"خطا: {msg_text}")
     
     def show_context_menu(self, position):
         """Show context menu on right-click"""
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """Utilities for Gregorian -> Jalali (Persian) date formatting and digit conversion"""
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 
 PERSIAN_DIGITS = {
     '0': '۰', '1': '۱', '2': '۲', '3': '۳', '4': '۴',
@@ -11,6 +12,9 @@ PERSIAN_DIGITS = {
 # Afghanistan Standard Time is UTC+4:30
 AFGHANISTAN_TIMEZONE_OFFSET = timedelta(hours=4, minutes=30)
 
+# Day numbers (members.joined_day) count days since 1970-01-01
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
 
 def to_persian_digits(s):
     return ''.join(PERSIAN_DIGITS.get(ch, ch) for ch in str(s))
@@ -46,6 +50,163 @@ def gregorian_to_jalali(gy, gm, gd):
     return jy, jm, jd
 
 
+def jalali_to_gregorian(jy, jm, jd):
+    # Inverse of gregorian_to_jalali (same 33-year arithmetic)
+    jy += 1595
+    days = -355668 + 365*jy + (jy//33)*8 + ((jy % 33) + 3)//4 + jd
+    if (jm < 7):
+        days += (jm-1)*31
+    else:
+        days += (jm-7)*30 + 186
+    gy = 400*(days//146097)
+    days %= 146097
+    if (days > 36524):
+        days -= 1
+        gy += 100*(days//36524)
+        days %= 36524
+        if (days >= 365):
+            days += 1
+    gy += 4*(days//1461)
+    days %= 1461
+    if (days > 365):
+        gy += (days-1)//365
+        days = (days-1) % 365
+    gd = days + 1
+    leap = (gy % 4 == 0 and gy % 100 != 0) or gy % 400 == 0
+    month_days = [31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    gm = 1
+    while gd > month_days[gm-1]:
+        gd -= month_days[gm-1]
+        gm += 1
+    return gy, gm, gd
+
+
+def jalali_day_number(jy, jm, jd):
+    """Days since 1970-01-01 of a Jalali date"""
+    return date(*jalali_to_gregorian(jy, jm, jd)).toordinal() - _EPOCH_ORDINAL
+
+
+def jalali_month_range(jy, jm):
+    """(first day, first day of the next month) of a Jalali month, as day numbers"""
+    next_year, next_month = (jy + 1, 1) if jm == 12 else (jy, jm + 1)
+    return jalali_day_number(jy, jm, 1), jalali_day_number(next_year, next_month, 1)
+
+
+def _parse_datetime(dt_str):
+    """(date fields, time fields, is_jalali) of a stored date string, or None"""
+    try:
+        parts = dt_str.split()
+        is_jalali = '/' in parts[0]
+        ymd = [int(x) for x in parts[0].split('/' if is_jalali else '-')]
+        hms = [int(x) for x in (parts[1].split(':') + ['0', '0'])[:3]] if len(parts) > 1 else []
+        if len(ymd) != 3:
+            return None
+        # jalali_to_gregorian would silently roll over out-of-range fields
+        if is_jalali and not (1 <= ymd[1] <= 12 and 1 <= ymd[2] <= (31 if ymd[1] <= 6 else 30)):
+            return None
+        return ymd, hms, is_jalali
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def persian_date_to_day(dt_str):
+    """Day number of a stored date ('1404/11/19', or Gregorian '2026-02-08'); None if unparsable.
+
+    Like format_datetime_to_persian, Gregorian strings with a time are UTC
+    and are moved to the Afghanistan date first.
+    """
+    parsed = _parse_datetime(dt_str)
+    if parsed is None:
+        return None
+    ymd, hms, is_jalali = parsed
+    try:
+        if is_jalali:
+            return jalali_day_number(*ymd)
+        moment = datetime(*ymd, *hms)
+        if hms:
+            moment += AFGHANISTAN_TIMEZONE_OFFSET
+        return moment.toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+
+
+def persian_datetime_to_epoch(dt_str):
+    """Unix time of a stored timestamp ('1404/11/19 14:23:45' Afghanistan time,
+    or Gregorian UTC '2026-02-08 09:53:45'); None if unparsable"""
+    parsed = _parse_datetime(dt_str)
+    if parsed is None:
+        return None
+    ymd, hms, is_jalali = parsed
+    try:
+        if is_jalali:
+            moment = datetime(*jalali_to_gregorian(*ymd), *hms) - AFGHANISTAN_TIMEZONE_OFFSET
+        else:
+            moment = datetime(*ymd, *hms)
+    except ValueError:
+        return None
+    return int((moment - datetime(1970, 1, 1)).total_seconds())
+
+
+def day_start_epoch(day):
+    """Unix time of Afghanistan midnight at the start of a day number"""
+    return day * 86400 - int(AFGHANISTAN_TIMEZONE_OFFSET.total_seconds())
+
+
+def as_of_epoch(dt_str):
+    """Unix time a stored date or timestamp refers to "as of"; None if unparsable.
+
+    A timestamp is that moment; a date alone ('1404/11/19') is the end of
+    that day, so "as of a date" includes everything that happened on it.
+    """
+    parsed = _parse_datetime(dt_str)
+    if parsed is None:
+        return None
+    if parsed[1]:
+        return persian_datetime_to_epoch(dt_str)
+    day = persian_date_to_day(dt_str)
+    return None if day is None else day_start_epoch(day + 1) - 1
+
+
+def day_number_to_jalali(day):
+    """(jy, jm, jd) of a day number"""
+    g = date.fromordinal(day + _EPOCH_ORDINAL)
+    return gregorian_to_jalali(g.year, g.month, g.day)
+
+
+# SQL functions (see db.register_extensions). `value` is a day number
+# (members.joined_day) or a stored date string; anything else gives None.
+# Cached: a GROUP BY over a table calls them with the same few values.
+@lru_cache(maxsize=8192)
+def _jalali_date(value):
+    if isinstance(value, int):
+        try:
+            return day_number_to_jalali(value)
+        except (OverflowError, ValueError):
+            return None
+    if isinstance(value, str):
+        day = persian_date_to_day(value)
+        return None if day is None else day_number_to_jalali(day)
+    return None
+
+
+def jalali_year(value):
+    """Jalali year of a day number or date string"""
+    parts = _jalali_date(value)
+    return parts[0] if parts else None
+
+
+def jalali_month(value):
+    """Jalali month (1-12) of a day number or date string"""
+    parts = _jalali_date(value)
+    return parts[1] if parts else None
+
+
+def jalali_month_key(value):
+    """Sortable Jalali month key, year * 100 + month (140411 for 1404/11)"""
+    parts = _jalali_date(value)
+    return parts[0] * 100 + parts[1] if parts else None
+
+
 def format_datetime_to_persian(dt_str, persian_digits=True, include_time=True):
     """Convert a datetime string to Jalali date string for display.
     Handles both Gregorian (YYYY-MM-DD) and Persian (YYYY/MM/DD) input formats.
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Persian text normalization for name comparison"""
+
+import math
+
+# Character folds applied, in order, by normalize_name() and by the SQL
+# expression behind the groups.name_norm / members.full_name_norm
+# columns, so Python lookups and the stored keys always agree. The
+# expression is baked into the schema by migration 4: changing this table
+# needs a new migration that rebuilds those columns. SQLite's parser
+# limits how deeply replace() calls nest, so keep the list short.
+NAME_FOLDS = (
+    ("ي", "ی"),   # Arabic yeh -> Persian yeh
+    ("ى", "ی"),   # alef maksura -> Persian yeh
+    ("ك", "ک"),   # Arabic kaf -> keheh
+    ("ة", "ه"),   # teh marbuta -> heh
+    ("ۀ", "ه"),   # heh with yeh above -> heh
+    ("أ", "ا"),   # alef with hamza above -> alef
+    ("إ", "ا"),   # alef with hamza below -> alef
+    ("\u0640", ""),  # tatweel
+    # Harakat and superscript alef
+    *((chr(code), "") for code in range(0x064b, 0x0653)),
+    ("\u0670", ""),
+    # ZWNJ, ZWJ and spaces: "محمد علی", "محمد\u200cعلی" and "محمدعلی"
+    # are the same name
+    ("\u200c", ""), ("\u200d", ""), (" ", ""), ("\u00a0", ""),
+)
+
+_ASCII_LOWER = {code: code + 32 for code in range(ord("A"), ord("Z") + 1)}
+
+
+def normalize_name(text):
+    """Comparison key for a person or group name (None stays None)"""
+    if text is None:
+        return None
+    for old, new in NAME_FOLDS:
+        text = text.replace(old, new)
+    # SQLite's lower() only folds ASCII; do the same
+    return text.translate(_ASCII_LOWER)
+
+
+def normalize_name_sql(expr):
+    """SQL expression computing normalize_name(expr) with built-in functions only"""
+    for old, new in NAME_FOLDS:
+        expr = f"replace({expr}, {_sql_text(old)}, {_sql_text(new)})"
+    return f"lower({expr})"
+
+
+def _sql_text(text):
+    if not text:
+        return "''"
+    if text.isprintable() and text != "'":
+        return f"'{text}'"
+    return f"char({ord(text)})"
+
+
+# Phone numbers: the same folds for normalize_phone() and for the SQL
+# behind members.phone_folded / members.phone_norm (migration 8), in two
+# steps to stay within the replace() nesting limit.
+PHONE_DIGIT_FOLDS = tuple((chr(zero + d), str(d)) for zero in (0x06F0, 0x0660)
+                          for d in range(10))
+PHONE_SEPARATORS = (" ", "\u00a0", "\u200c", "-", "(", ")", ".", "/", "+")
+
+
+def normalize_phone(text):
+    """Canonical phone number: ASCII digits, national 07... form for Afghan numbers.
+
+    "+93 799 123 456", "0093799123456", "۰۷۹۹-۱۲۳-۴۵۶" and "799123456" all
+    become "0799123456". Returns None for None or an empty number.
+    """
+    if text is None:
+        return None
+    for old, new in PHONE_DIGIT_FOLDS:
+        text = text.replace(old, new)
+    for separator in PHONE_SEPARATORS:
+        text = text.replace(separator, "")
+    if text.startswith("0093"):
+        text = "0" + text[4:]
+    elif len(text) == 11 and text.startswith("93"):
+        text = "0" + text[2:]
+    elif len(text) == 9 and text.startswith("7"):
+        text = "0" + text
+    return text or None
+
+
+def fold_phone_digits_sql(expr):
+    """SQL expression for the first step of normalize_phone(): ASCII digits"""
+    for old, new in PHONE_DIGIT_FOLDS:
+        expr = f"replace({expr}, {_sql_text(old)}, {_sql_text(new)})"
+    return expr
+
+
+def normalize_phone_sql(folded):
+    """SQL expression computing normalize_phone() from fold_phone_digits_sql()'s result"""
+    for separator in PHONE_SEPARATORS:
+        folded = f"replace({folded}, {_sql_text(separator)}, '')"
+    return f"""nullif(CASE
+        WHEN substr({folded}, 1, 4) = '0093' THEN '0' || substr({folded}, 5)
+        WHEN length({folded}) = 11 AND substr({folded}, 1, 2) = '93'
+          THEN '0' || substr({folded}, 3)
+        WHEN length({folded}) = 9 AND substr({folded}, 1, 1) = '7' THEN '0' || {folded}
+        ELSE {folded} END, '')"""
+
+
+# Persian alphabetical order. Arabic letter forms sort with their Persian
+# counterparts, ZWNJ sorts like a space and harakat/tatweel are ignored.
+PERSIAN_ALPHABET = "ءآابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی"
+_SORT_VARIANTS = {"أ": "ا", "إ": "ا", "ٱ": "ا", "ؤ": "و", "ئ": "ی", "ي": "ی",
+                  "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه"}
+# Letters become private-use code points in alphabet order, so comparing
+# translated strings orders them correctly (after digits and Latin).
+_SORT_TABLE = {ord(letter): 0xE000 + rank for rank, letter in enumerate(PERSIAN_ALPHABET)}
+_SORT_TABLE.update({ord(variant): _SORT_TABLE[ord(letter)]
+                    for variant, letter in _SORT_VARIANTS.items()})
+_SORT_TABLE.update({0x06F0 + d: ord("0") + d for d in range(10)})
+_SORT_TABLE.update({0x0660 + d: ord("0") + d for d in range(10)})
+_SORT_TABLE.update({code: None for code in range(0x064B, 0x0653)})
+_SORT_TABLE.update({0x0670: None, 0x0640: None, 0x200C: ord(" "), 0x00A0: ord(" ")})
+
+
+def persian_sort_key(text):
+    """Sort key for Persian alphabetical order (ties broken by the raw text)"""
+    return text.translate(_SORT_TABLE), text
+
+
+def persian_collate(a, b):
+    """SQLite collation function for the PERSIAN collation"""
+    key_a, key_b = persian_sort_key(a), persian_sort_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+# Folds for full-text search (SQL function fa_normalize, see
+# db.register_extensions): the letter folds of NAME_FOLDS, but ZWNJ and
+# spaces separate words instead of vanishing, and Persian/Arabic digits
+# become ASCII so "۰۷۹۹" finds "0799".
+_SEARCH_TABLE = {ord(old): new or None for old, new in NAME_FOLDS
+                 if old not in ("\u200c", " ", "\u00a0")}
+_SEARCH_TABLE.update({0x200C: ord(" "), 0x00A0: ord(" ")})
+_SEARCH_TABLE.update({0x06F0 + d: ord("0") + d for d in range(10)})
+_SEARCH_TABLE.update({0x0660 + d: ord("0") + d for d in range(10)})
+
+
+def normalize_search(text):
+    """Search form of a text: folded letters, ASCII digits, lower case"""
+    if text is None:
+        return None
+    return text.translate(_SEARCH_TABLE).lower()
+
+
+def name_ngrams(text, n=3):
+    """Character n-grams of a name's normalize_name() key (see key_ngrams)"""
+    return key_ngrams(normalize_name(text or ""), n)
+
+
+def key_ngrams(key, n=3):
+    """Character n-grams of an already normalized name key.
+
+    The key is padded with a space on both sides (the key itself has
+    none), so the first and last letters get n-grams of their own and even
+    a two-letter name has some. Matches the members_ngram index, which
+    stores " " || full_name_norm || " ".
+    """
+    key = f" {key} "
+    return {key[i:i + n] for i in range(len(key) - n + 1)}
+
+
+def min_overlap(threshold, size):
+    """ceil(threshold * size), without float error pushing an exact integer up.
+
+    With size = len(a), names at least `threshold` similar to `a` share at
+    least this many n-grams with it.
+    """
+    return math.ceil(threshold * size - 1e-9)
+
+
+def ngram_similarity(a, b):
+    """Jaccard similarity of two n-gram sets (0.0 - 1.0)"""
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)